@@ -0,0 +1,100 @@
+from datetime import date, datetime
+
+import backend
+
+
+# Spending analytics shared by the GUI, scripts and benchmarks. Nothing here touches Tk: functions
+# that read data take a backend handle (the backend module by default, or anything with the same
+# query functions), the rest are pure functions of what was read. Amounts are in cents unless noted.
+# NumPy is only imported by the time series functions, so importing this module stays cheap.
+
+
+# [start, end) day bounds of the current month
+def current_month(today=None):
+    today = today or datetime.now()
+    return backend.period_bounds(today.strftime("%B"), today.year)
+
+
+# [start, end) day bounds of the `months` whole months before end (the first day of a month)
+def months_before(end, months):
+    end = backend.to_day(end)
+    last = backend.from_day(end)
+    first_month = last.year * 12 + last.month - 1 - months
+    return backend.to_day(date(first_month // 12, first_month % 12 + 1, 1)), end
+
+
+# {category: (budget, spent, savings)} for each of the user's budgets between start and end
+def budget_report(user, start, end, db=backend):
+    return {category: (budget, spent, budget - spent)
+            for category, budget, spent in db.chart_series(user, start, end, "bar")}
+
+
+# the rows of a budget report whose category still exists
+def savings_table(report, categories):
+    categories = set(categories)
+    return {category: amounts for category, amounts in report.items() if category in categories}
+
+
+# the n categories with the most (top=True) or least savings, as (category, savings in dollars)
+def ranked_savings(report, n=5, top=True):
+    savings = sorted(((category, backend.from_cents(amounts[2])) for category, amounts in report.items()),
+                     key=lambda saving: saving[1], reverse=top)
+    return savings[:n]
+
+
+# categories of a budget report that are over budget (optionally only checking one category)
+def exceeded_budgets(report, category=None):
+    return [name for name, amounts in report.items()
+            if amounts[2] < 0 and (category is None or name == category)]
+
+
+# {category: total spent} between start and end
+def spending_distribution(user, start, end, db=backend):
+    return dict(db.chart_series(user, start, end, "pie"))
+
+
+# line graph resolution by window length: daily up to ~3 months, weekly up to ~2 years, monthly beyond
+LINE_RESOLUTIONS = ((92, "day"), (731, "week"))
+
+
+# cumulative spending over [start, end) from (day number, cents) totals, binned by day, week or month
+# (default: picked from the window length); returns (datetime64 bin edges, cumulative dollars at each edge)
+def cumulative_spend(daily, start, end, resolution=None):
+    import numpy as np
+
+    start, end = backend.to_day(start), backend.to_day(end)
+    if resolution is None:
+        resolution = next((name for length, name in LINE_RESOLUTIONS if end - start <= length), "month")
+
+    days = np.fromiter((day for day, total in daily), dtype=np.int64, count=len(daily))
+    cents = np.fromiter((total for day, total in daily), dtype=np.int64, count=len(daily))
+    if len(days) == 0:
+        return np.array([], dtype='datetime64[D]'), np.array([])
+    # day numbers count days since 1970-01-01, the same epoch as datetime64
+    dates = days.astype('datetime64[D]')
+    first_day = np.datetime64(start, 'D')
+
+    # bin index of every day with spending, and the first date of each bin
+    if resolution == "day":
+        bins = days - start
+        edges = first_day + np.arange(bins.max() + 2)
+    elif resolution == "week":
+        bins = (days - start) // 7
+        edges = first_day + 7 * np.arange(bins.max() + 2)
+    else:
+        first_month = first_day.astype('datetime64[M]')
+        bins = (dates.astype('datetime64[M]') - first_month).astype(np.int64)
+        edges = (first_month + np.arange(bins.max() + 2)).astype('datetime64[D]')
+        edges[0] = first_day
+
+    # totals per bin in one pass, then the running total at the end of each bin (starting from 0)
+    totals = np.bincount(bins, weights=cents)
+    cumulative = np.concatenate(([0], np.cumsum(totals))) / 100
+    # the last bin ends at the window end at the latest
+    edges[-1] = min(edges[-1], np.datetime64(end, 'D'))
+    return edges, cumulative
+
+
+# the cumulative spending graph for a window, built from the cached daily totals
+def spending_over_time(user, start, end, resolution=None, db=backend):
+    return cumulative_spend(db.chart_series(user, start, end, "line"), start, end, resolution)
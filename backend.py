@@ -1,346 +1,1334 @@
+import glob
+import hashlib
+import os
+import random
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+import credentials
+
+
+# database files (use_databases() points the backend somewhere else)
+USER_DB = "login_info.db"
+EXPENSE_DB = "expenses.db"
+
+# categories every new user starts with
+START_CATEGORIES = ["Investments", "Education", "Entertainment", "Fees & Charges", "Personal Care", "Taxes",
+                    "Travel", "Food & Dining", "Home", "Kids", "Shopping", "Bills & Utilities"]
+
+# settings applied once to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers don't block the writer
+    "PRAGMA synchronous=NORMAL",    # fsync on checkpoint rather than on every commit (safe with WAL)
+    "PRAGMA cache_size=-16000",     # ~16MB page cache per connection
+    "PRAGMA mmap_size=268435456",   # map up to 256MB of the database file
+    "PRAGMA temp_store=MEMORY",
+)
+
+# prepared statements kept per connection (the query registries below reuse them instead of re-parsing)
+STATEMENT_CACHE_SIZE = 256
+
+# open connections kept per thread (with a file per user there can be many databases)
+MAX_CONNECTIONS = 32
+
+# several app instances (processes) can write to the same files: a writer waits up to BUSY_TIMEOUT seconds for
+# another's lock, and if it still can't get it, tries again up to WRITE_RETRIES times after a random pause
+# of up to RETRY_DELAY * 2**attempt seconds (the jitter keeps waiting writers from retrying in lockstep)
+BUSY_TIMEOUT = 2.0
+WRITE_RETRIES = 4
+RETRY_DELAY = 0.05
+
+# how expense data is split between database files (see the storage router below):
+#   ""      everything in EXPENSE_DB
+#   "user"  a file per user
+#   "<n>"   n files, each user hashed to one of them
+SHARDING = os.environ.get("EXPENSE_SHARDING", "")
+SHARD_DIR = os.environ.get("EXPENSE_SHARD_DIR", "shards")
+
+
+# --------------------------------------------------- connection manager
+
+# each thread keeps its own connections (sqlite3 connections shouldn't be shared between threads)
+_local = threading.local()
+
+
+def get_connection(db=None):
+    # default to the expense database
+    db = db or EXPENSE_DB
+    # look up the connections cached for this thread (least recently used first)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = OrderedDict()
+    conn = connections.get(db)
+    if conn is None:
+        # autocommit mode; transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(db, timeout=BUSY_TIMEOUT, isolation_level=None,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        # one-time setup for the new connection
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[db] = conn
+        # close the least recently used connections that aren't in a transaction (a stream still reading from
+        # one would fail, but a thread only reads one stream at a time and opens no other databases meanwhile)
+        for old_db, old_conn in list(connections.items())[:-MAX_CONNECTIONS]:
+            if not old_conn.in_transaction:
+                del connections[old_db]
+                old_conn.close()
+    else:
+        connections.move_to_end(db)
+    return conn
+
+
+# counters for write transactions in this process (see write_stats())
+_write_stats = {"transactions": 0, "retries": 0, "failed": 0, "lock_wait": 0.0}
+_write_stats_lock = threading.Lock()
+
+
+def _is_busy(error):
+    return getattr(error, "sqlite_errorcode", None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) \
+        or "locked" in str(error)
+
+
+# open a write transaction, taking the database's write lock up front (BEGIN IMMEDIATE) so it can't fail
+# halfway through with "database is locked" when another writer got in first
+def _begin_write(conn):
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as error:
+            if not _is_busy(error) or attempt == WRITE_RETRIES:
+                with _write_stats_lock:
+                    _write_stats["failed"] += 1
+                raise
+        with _write_stats_lock:
+            _write_stats["retries"] += 1
+        time.sleep(random.uniform(0, RETRY_DELAY * 2 ** attempt))
+        attempt += 1
+    with _write_stats_lock:
+        _write_stats["transactions"] += 1
+        _write_stats["lock_wait"] += time.perf_counter() - started
+
+
+# write transaction counts, retries, transactions that gave up and total seconds spent waiting for the lock
+def write_stats():
+    with _write_stats_lock:
+        return dict(_write_stats)
+
+
+# connections of this thread that are in a read transaction (opened with write=False)
+def _read_transactions():
+    read = getattr(_local, "read_transactions", None)
+    if read is None:
+        read = _local.read_transactions = set()
+    return read
+
+
+# invalidations requested while a transaction is open on this thread are held back until the outermost one
+# has finished: until it commits other connections still read the old rows (and it may yet roll back), so
+# dropping cached rows earlier would only let them be cached again from the old data
+@contextmanager
+def _deferring_invalidations():
+    outermost = getattr(_local, "pending_invalidations", None) is None
+    if outermost:
+        _local.pending_invalidations = []
+    try:
+        yield
+    finally:
+        if outermost:
+            pending, _local.pending_invalidations = _local.pending_invalidations, None
+            for invalidate, args in pending:
+                invalidate(*args)
+
+
+# queue an invalidation if a transaction is open on this thread, returns whether it was queued
+def _defer_invalidation(invalidate, *args):
+    pending = getattr(_local, "pending_invalidations", None)
+    if pending is None:
+        return False
+    pending.append((invalidate, args))
+    return True
+
+
+# write=False opens a read transaction (a consistent snapshot that doesn't block writers)
+@contextmanager
+def transaction(db=None, write=True):
+    conn = get_connection(db)
+    read_transactions = _read_transactions()
+    # join the enclosing transaction if there is one
+    if conn.in_transaction:
+        # a read transaction hasn't taken the write lock, so a write could fail halfway with "database is locked"
+        if write and conn in read_transactions:
+            raise RuntimeError("Can't write inside a read transaction (open the outer one with write=True)")
+        yield conn
+        return
+    with _deferring_invalidations():
+        if write:
+            _begin_write(conn)
+        else:
+            conn.execute("BEGIN")
+            read_transactions.add(conn)
+        try:
+            yield conn
+        except BaseException:
+            # SQLite rolls back by itself after some errors (e.g. a full disk or an interrupt)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        else:
+            try:
+                conn.execute("COMMIT")
+            except BaseException:
+                # e.g. the disk is full; don't leave the connection in the failed transaction
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        finally:
+            read_transactions.discard(conn)
+
+
+def close_connections():
+    # close every connection opened by the calling thread
+    connections = getattr(_local, "connections", {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+# switch to other database files or sharding (e.g. for benchmarks or scripts); call before other threads
+# use the backend
+def use_databases(expense_db=None, user_db=None, sharding=None, shard_dir=None):
+    global EXPENSE_DB, USER_DB, SHARDING, SHARD_DIR
+    if sharding is not None:
+        _check_sharding(sharding)
+    close_connections()
+    EXPENSE_DB = expense_db or EXPENSE_DB
+    USER_DB = user_db or USER_DB
+    SHARDING = SHARDING if sharding is None else sharding
+    SHARD_DIR = shard_dir or SHARD_DIR
+    _prepared_shards.clear()
+    # cached rows belong to the previous files
+    invalidate_cache()
+    invalidate_charts()
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- storage router
+
+# every function taking a user reads and writes the database returned by shard_for(user); with sharding on,
+# each user's categories, expenses and budgets live in their own file (or a file shared with the users
+# hashed to the same bucket), so one user's writes don't wait on another's and queries only see the rows
+# stored alongside theirs. Shard files are created (and migrated) the first time they are used.
+
+# shard files already created and migrated by this process
+_prepared_shards = set()
+_shard_lock = threading.Lock()
+
+
+def _check_sharding(sharding):
+    if sharding not in ("", "user") and not (sharding.isdigit() and int(sharding) > 0):
+        raise ValueError(f"Unsupported sharding: {sharding!r} (use '', 'user' or a number of files)")
+
+
+_check_sharding(SHARDING)
+
+
+# the file a user's data is stored in
+def shard_path(user):
+    if not SHARDING:
+        return EXPENSE_DB
+    if SHARDING == "user":
+        # readable and safe as a file name, the digest keeps names that clean up the same apart
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", user)[:40]
+        return os.path.join(SHARD_DIR, f"user-{name}-{hashlib.sha1(user.encode()).hexdigest()[:8]}.db")
+    # crc32 rather than hash(), which changes between runs
+    return os.path.join(SHARD_DIR, f"shard-{zlib.crc32(user.encode()) % int(SHARDING):04d}.db")
+
+
+# the database holding a user's data, created and brought up to date the first time it is used
+def shard_for(user):
+    db = shard_path(user)
+    if db not in _prepared_shards:
+        with _shard_lock:
+            if db not in _prepared_shards:
+                if SHARDING:
+                    os.makedirs(SHARD_DIR, exist_ok=True)
+                connect_categories(db)
+                connect_expense(db)
+                connect_budget(db)
+                migrate(db, EXPENSE_MIGRATIONS)
+                _prepared_shards.add(db)
+    return db
+
+
+# every expense database that exists, for admin tasks that go over all users' data
+def shards():
+    if not SHARDING:
+        return [EXPENSE_DB]
+    prefix = "user-" if SHARDING == "user" else "shard-"
+    return sorted(glob.glob(os.path.join(glob.escape(SHARD_DIR), f"{prefix}*.db")))
+
+
+# the databases a table change applies to: the one given, or every expense database
+def _target_databases(db):
+    return [db] if db else shards()
+
+
+# users whose data is still in EXPENSE_DB although sharding is on (stored before it was switched on);
+# it can't be seen until move_to_shards() has moved it
+def unsharded_users():
+    if not SHARDING or not os.path.exists(EXPENSE_DB):
+        return []
+    conn = get_connection(EXPENSE_DB)
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    users = set()
+    for table in ("categories", "expenses", "budgets"):
+        if table in tables:
+            users.update(user for user, in conn.execute(f"SELECT DISTINCT user FROM {table}"))
+    return sorted(users)
+
+
+# copy rows (id last) into a shard's table, keeping their ids unless the shard already uses one; the id each
+# row got is recorded in the shard's moved_rows in the same transaction, so a row copied by an earlier run
+# that was interrupted before the originals were deleted isn't copied again
+def _copy_rows(conn, user, table, rows):
+    for row in rows:
+        moved = conn.execute("SELECT target_id FROM moved_rows WHERE source_table=? AND source_id=?",
+                             (table, row[-1])).fetchone()
+        if moved is not None:
+            copy = conn.execute(f"SELECT * FROM {table} WHERE id=?", (moved[0],)).fetchone()
+            # (a different row means the record is left over from an earlier move and the id was reused)
+            if copy is not None and copy[:-1] == row[:-1]:
+                continue
+        taken = conn.execute(f"SELECT 1 FROM {table} WHERE id=?", (row[-1],)).fetchone() is not None
+        cursor = conn.execute(f"INSERT INTO {table} VALUES ({', '.join('?' for _ in row)})",
+                              (*row[:-1], None if taken else row[-1]))
+        conn.execute("INSERT OR REPLACE INTO moved_rows VALUES (?, ?, ?, ?)", (user, table, row[-1], cursor.lastrowid))
+
+
+# move the categories, expenses and budgets of unsharded_users() into their shards, a user at a time
+# (each is copied, then deleted from EXPENSE_DB, so an interrupted run can simply be started again and
+# picks up where it stopped); returns the number of users moved
+def move_to_shards(progress=None):
+    if not SHARDING:
+        raise ValueError("Sharding is off (set EXPENSE_SHARDING to 'user' or a number of files)")
+    users = unsharded_users()
+    if not users:
+        return 0
+    # the old file may be from an older version
+    connect_categories(EXPENSE_DB)
+    connect_expense(EXPENSE_DB)
+    connect_budget(EXPENSE_DB)
+    migrate(EXPENSE_DB, EXPENSE_MIGRATIONS)
+
+    source = get_connection(EXPENSE_DB)
+    for count, user in enumerate(users, start=1):
+        with transaction(shard_for(user)) as conn:
+            # source row -> the id it was given in the shard, for the rows of users still being moved
+            conn.execute("""CREATE TABLE IF NOT EXISTS moved_rows (
+                    user text,
+                    source_table text,
+                    source_id integer,
+                    target_id integer,
+                    PRIMARY KEY (source_table, source_id)
+                    )""")
+            for category, in source.execute("SELECT category FROM categories WHERE user=?", (user,)).fetchall():
+                if conn.execute("SELECT 1 FROM categories WHERE user=? AND category=?",
+                                (user, category)).fetchone() is None:
+                    conn.execute("INSERT INTO categories VALUES (?, ?)", (user, category))
+            _copy_rows(conn, user, "expenses",
+                       source.execute("SELECT * FROM expenses WHERE user=?", (user,)).fetchall())
+            _copy_rows(conn, user, "budgets",
+                       source.execute("SELECT * FROM budgets WHERE user=?", (user,)).fetchall())
+            _bump_version(conn, user)
+        with transaction(EXPENSE_DB) as conn:
+            for table in ("categories", "expenses", "budgets"):
+                conn.execute(f"DELETE FROM {table} WHERE user=?", (user,))
+            _bump_version(conn, user)
+        # the originals are gone, so the record of where they went isn't needed any more
+        with transaction(shard_for(user)) as conn:
+            conn.execute("DELETE FROM moved_rows WHERE user=?", (user,))
+        invalidate_cache(user=user)
+        invalidate_charts(user)
+        if progress is not None:
+            progress(count, len(users))
+    return len(users)
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- amounts (stored as integer cents)
+
+# largest amount that fits in an SQLite integer column
+MAX_CENTS = 2 ** 63 - 1
+
+
+# convert a dollar amount (float, Decimal, or text like "12.50" / "$1,200") to integer cents;
+# raises ValueError for anything else, infinities and NaN, and amounts too large to store
+def to_cents(amount):
+    if isinstance(amount, str):
+        amount = amount.strip().replace('$', '').replace(',', '')
+    try:
+        amount = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {amount}")
+    if abs(amount) * 100 > MAX_CENTS:
+        raise ValueError(f"Amount too large: {amount}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+# convert integer cents to dollars (for charts and calculations)
+def from_cents(cents):
+    return cents / 100
+
+
+# format integer cents for display, e.g. 1250 -> "12.50"
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{dollars}.{cents:02d}"
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- dates (stored as day numbers since 1970-01-01)
+
+EPOCH = date(1970, 1, 1)
+
+# day numbers of the first and last dates Python can represent (anything outside couldn't be displayed)
+MIN_DAY = (date.min - EPOCH).days
+MAX_DAY = (date.max - EPOCH).days
+
+
+# convert a date, datetime or "YYYY-MM-DD" text to a day number (day numbers are passed through);
+# raises ValueError for anything else and for day numbers outside MIN_DAY..MAX_DAY
+def to_day(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        if not MIN_DAY <= value <= MAX_DAY:
+            raise ValueError(f"Day number out of range: {value}")
+        return value
+    if isinstance(value, str):
+        value = date.fromisoformat(value.strip())
+    elif isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        raise ValueError(f"Invalid date: {value!r}")
+    return (value - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + timedelta(days=day)
+
+
+# format a day number for display, e.g. 19727 -> "2024-01-05"
+def format_day(day):
+    return from_day(day).isoformat()
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- read cache (small, hot, rarely changing tables)
+
+# cached rows are stored with the version of the user's data they were read at (see user_versions in the
+# migrations): every write to a user's data bumps it in the same transaction, whichever process makes it, so
+# an entry is only served while the version in the database still matches
+
+# number of (table, user) entries kept, least recently used are dropped first
+CACHE_SIZE = 1024
+
+# (database, table, user) -> (version, rows), shared by all threads, most recently used last
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# bumped by every invalidation, so a read that raced a write isn't cached
+_cache_generation = 0
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+# record a change to a user's data (called in the transaction making it)
+def _bump_version(conn, user):
+    conn.execute("""INSERT INTO user_versions VALUES (?, 1)
+                ON CONFLICT (user) DO UPDATE SET version = version + 1""", (user,))
+
+
+# the current version of a user's data in a database
+def _user_version(conn, user):
+    row = conn.execute("SELECT version FROM user_versions WHERE user=?", (user,)).fetchone()
+    return row[0] if row else 0
+
+
+# return the cached rows for (table, user), calling load() to fill the cache on a miss
+def _cached(table, user, load):
+    db = shard_for(user)
+    conn = get_connection(db)
+    # inside a transaction the rows may include uncommitted writes, which mustn't be shared
+    if conn.in_transaction:
+        return list(load())
+    # read before the rows, so rows newer than the version are reloaded next time rather than the reverse
+    version = _user_version(conn, user)
+    key = (db, table, user)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return list(entry[1])
+        _cache_stats["misses"] += 1
+        generation = _cache_generation
+    rows = tuple(load())
+    with _cache_lock:
+        if generation == _cache_generation:
+            _cache[key] = (version, rows)
+            _cache.move_to_end(key)
+            if len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return list(rows)
+
+
+# drop cached rows for one user's table, a whole table (user=None) or everything (table=None)
+def invalidate_cache(table=None, user=None):
+    global _cache_generation
+    if _defer_invalidation(invalidate_cache, table, user):
+        return
+    with _cache_lock:
+        _cache_generation += 1
+        for key in list(_cache):
+            if (table is None or key[1] == table) and (user is None or key[2] == user):
+                del _cache[key]
+
+
+# hit/miss counters and the number of cached entries
+def cache_info():
+    with _cache_lock:
+        return {**_cache_stats, "entries": len(_cache)}
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- schema migrations
+
+# forward migrations as (version, statements), applied in order and recorded in schema_version
+# (a statement can also be a function taking the connection, for changes SQL alone can't express)
+EXPENSE_MIGRATIONS = [
+    (1, (
+        "CREATE INDEX IF NOT EXISTS expenses_user_date ON expenses (user, date)",
+        "CREATE INDEX IF NOT EXISTS expenses_user_category_date ON expenses (user, category, date)",
+        "CREATE INDEX IF NOT EXISTS budgets_user_category ON budgets (user, category)",
+        "CREATE INDEX IF NOT EXISTS categories_user_category ON categories (user, category)",
+    )),
+    (2, (
+        # per user/month/category spending, kept in step with the expenses table by the triggers below
+        """CREATE TABLE IF NOT EXISTS monthly_totals (
+                user text,
+                year_month text,
+                category text,
+                total real,
+                count integer,
+                PRIMARY KEY (user, year_month, category)
+                )""",
+        """CREATE TRIGGER IF NOT EXISTS monthly_totals_insert AFTER INSERT ON expenses BEGIN
+                INSERT INTO monthly_totals VALUES (NEW.user, substr(NEW.date, 1, 7), NEW.category, NEW.amount, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END""",
+        """CREATE TRIGGER IF NOT EXISTS monthly_totals_delete AFTER DELETE ON expenses BEGIN
+                UPDATE monthly_totals SET total = total - OLD.amount, count = count - 1
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category
+                AND count <= 0;
+            END""",
+        """CREATE TRIGGER IF NOT EXISTS monthly_totals_update AFTER UPDATE OF user, amount, category, date
+            ON expenses BEGIN
+                UPDATE monthly_totals SET total = total - OLD.amount, count = count - 1
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category
+                AND count <= 0;
+                INSERT INTO monthly_totals VALUES (NEW.user, substr(NEW.date, 1, 7), NEW.category, NEW.amount, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END""",
+        # fill the table from the expenses already in the database
+        """INSERT INTO monthly_totals
+                SELECT user, substr(date, 1, 7), category, SUM(amount), COUNT(*) FROM expenses
+                GROUP BY user, substr(date, 1, 7), category""",
+    )),
+    (3, (
+        # store expense amounts as integer cents
+        """CREATE TABLE expenses_cents (
+                user text,
+                name text,
+                amount_cents INTEGER NOT NULL,
+                category text,
+                date text,
+                id INTEGER PRIMARY KEY
+                )""",
+        """INSERT INTO expenses_cents
+                SELECT user, name, CAST(ROUND(amount * 100) AS INTEGER), category, date, id FROM expenses""",
+        "DROP TABLE expenses",
+        "ALTER TABLE expenses_cents RENAME TO expenses",
+        "CREATE INDEX expenses_user_date ON expenses (user, date)",
+        "CREATE INDEX expenses_user_category_date ON expenses (user, category, date)",
+        # store budget amounts (previously text) as integer cents
+        """CREATE TABLE budgets_cents (
+                user text,
+                category text,
+                amount_cents INTEGER NOT NULL,
+                id INTEGER PRIMARY KEY
+                )""",
+        """INSERT INTO budgets_cents
+                SELECT user, category, CAST(ROUND(CAST(amount AS REAL) * 100) AS INTEGER), id FROM budgets""",
+        "DROP TABLE budgets",
+        "ALTER TABLE budgets_cents RENAME TO budgets",
+        "CREATE INDEX budgets_user_category ON budgets (user, category)",
+        # the rollup sums cents too (its triggers were dropped with the old expenses table)
+        "DROP TABLE monthly_totals",
+        """CREATE TABLE monthly_totals (
+                user text,
+                year_month text,
+                category text,
+                total_cents INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user, year_month, category)
+                )""",
+        """CREATE TRIGGER monthly_totals_insert AFTER INSERT ON expenses BEGIN
+                INSERT INTO monthly_totals VALUES (NEW.user, substr(NEW.date, 1, 7), NEW.category, NEW.amount_cents, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+            END""",
+        """CREATE TRIGGER monthly_totals_delete AFTER DELETE ON expenses BEGIN
+                UPDATE monthly_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category
+                AND count <= 0;
+            END""",
+        """CREATE TRIGGER monthly_totals_update AFTER UPDATE OF user, amount_cents, category, date
+            ON expenses BEGIN
+                UPDATE monthly_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = substr(OLD.date, 1, 7) AND category = OLD.category
+                AND count <= 0;
+                INSERT INTO monthly_totals VALUES (NEW.user, substr(NEW.date, 1, 7), NEW.category, NEW.amount_cents, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+            END""",
+        """INSERT INTO monthly_totals
+                SELECT user, substr(date, 1, 7), category, SUM(amount_cents), COUNT(*) FROM expenses
+                GROUP BY user, substr(date, 1, 7), category""",
+    )),
+    (4, (
+        # store expense dates as day numbers, so date ranges compare integers
+        # (2440587.5 is the Julian day of 1970-01-01)
+        """CREATE TABLE expenses_days (
+                user text,
+                name text,
+                amount_cents INTEGER NOT NULL,
+                category text,
+                day INTEGER NOT NULL,
+                id INTEGER PRIMARY KEY
+                )""",
+        """INSERT INTO expenses_days
+                SELECT user, name, amount_cents, category, CAST(julianday(date) - 2440587.5 AS INTEGER), id
+                FROM expenses""",
+        "DROP TABLE expenses",
+        "ALTER TABLE expenses_days RENAME TO expenses",
+        "CREATE INDEX expenses_user_day ON expenses (user, day)",
+        "CREATE INDEX expenses_user_category_day ON expenses (user, category, day)",
+        # the rollup keeps its "YYYY-MM" keys; its triggers were dropped with the old expenses table
+        """CREATE TRIGGER monthly_totals_insert AFTER INSERT ON expenses BEGIN
+                INSERT INTO monthly_totals
+                VALUES (NEW.user, strftime('%Y-%m', NEW.day + 2440587.5), NEW.category, NEW.amount_cents, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+            END""",
+        """CREATE TRIGGER monthly_totals_delete AFTER DELETE ON expenses BEGIN
+                UPDATE monthly_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                WHERE user = OLD.user AND year_month = strftime('%Y-%m', OLD.day + 2440587.5)
+                AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = strftime('%Y-%m', OLD.day + 2440587.5)
+                AND category = OLD.category AND count <= 0;
+            END""",
+        """CREATE TRIGGER monthly_totals_update AFTER UPDATE OF user, amount_cents, category, day
+            ON expenses BEGIN
+                UPDATE monthly_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                WHERE user = OLD.user AND year_month = strftime('%Y-%m', OLD.day + 2440587.5)
+                AND category = OLD.category;
+                DELETE FROM monthly_totals
+                WHERE user = OLD.user AND year_month = strftime('%Y-%m', OLD.day + 2440587.5)
+                AND category = OLD.category AND count <= 0;
+                INSERT INTO monthly_totals
+                VALUES (NEW.user, strftime('%Y-%m', NEW.day + 2440587.5), NEW.category, NEW.amount_cents, 1)
+                ON CONFLICT (user, year_month, category)
+                DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+            END""",
+    )),
+    (5, (
+        # one index per sort order, so sorted and paged queries walk an index instead of sorting
+        # (the id tie-breaker comes free: index entries are ordered by rowid after their columns)
+        "CREATE INDEX IF NOT EXISTS expenses_user ON expenses (user)",
+        "CREATE INDEX IF NOT EXISTS expenses_user_name ON expenses (user, name)",
+        "CREATE INDEX IF NOT EXISTS expenses_user_amount ON expenses (user, amount_cents)",
+    )),
+    (6, (
+        # a version per user, bumped with every change to their categories, expenses or budgets, so the read
+        # caches (in every process) can tell when their rows are out of date
+        """CREATE TABLE IF NOT EXISTS user_versions (
+                user text PRIMARY KEY,
+                version INTEGER NOT NULL
+                )""",
+    )),
+]
+
+USER_MIGRATIONS = [
+    (1, (
+        # usernames are unique: keep the first account registered under each name (the one logins matched)
+        "DELETE FROM user WHERE rowid NOT IN (SELECT MIN(rowid) FROM user GROUP BY username)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS user_username ON user (username)",
+    )),
+]
+
+
+def schema_version(db=None):
+    conn = get_connection(db)
+    # create the version table the first time a database is migrated
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied text
+                )""")
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(db, migrations):
+    current = schema_version(db)
+    for version, statements in migrations:
+        if version <= current:
+            continue
+        # each migration is applied (and recorded) atomically
+        with transaction(db) as conn:
+            # another process may have applied it since the version was read
+            if conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0] >= version:
+                current = version
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute("INSERT INTO schema_version VALUES (?, ?)", (version, datetime.now().isoformat()))
+        current = version
+    return current
+
+
+# bring the user database and every expense database up to date (run at startup, once the tables exist)
+def run_migrations():
+    migrate(USER_DB, USER_MIGRATIONS)
+    for db in shards():
+        migrate(db, EXPENSE_MIGRATIONS)
+
+
+# make sure the tables exist and are up to date (every entry point calls this before using the databases)
+def prepare_databases():
+    # with sharding on, data left in EXPENSE_DB would silently disappear from view
+    users = unsharded_users()
+    if users:
+        raise RuntimeError(f"{EXPENSE_DB} still holds the data of {len(users)} user(s) stored before sharding was "
+                           f"switched on; run 'python maintenance.py move-to-shards' first")
+    connect_user()
+    connect_categories()
+    connect_expense()
+    connect_budget()
+    run_migrations()
+
+# ----------------------------------------------------------------------------------------------
 
 
 # --------------------------------------------------- backend functions for login_info database
 
 
 def connect_user():
-    # create/connect to login_info database
-    conn = sqlite3.connect("login_info.db")
-    # create cursor
-    cur = conn.cursor()
     # create table of users
-    cur.execute("""CREATE TABLE IF NOT EXISTS user (
-                username text,
-                password text
-        )""")
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(USER_DB) as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS user (
+                    username text,
+                    password text
+            )""")
 
 
 def insert_user(username, password):
-    # connect to login_info database
-    conn = sqlite3.connect("login_info.db")
-    # create cursor
-    cur = conn.cursor()
-    # insert user info into table of users
-    cur.execute("""INSERT INTO user VALUES (:username_info, :password_info)""",
-                {
-                    'username_info': username,
-                    'password_info': password
-                }
-                )
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    # insert user info into table of users (the password is stored hashed)
+    password = credentials.hash_password(password)
+    with transaction(USER_DB) as conn:
+        conn.execute("""INSERT INTO user VALUES (:username_info, :password_info)""",
+                     {
+                         'username_info': username,
+                         'password_info': password
+                     }
+                     )
 
 
 def query_user():
-    # connect to login_info database
-    conn = sqlite3.connect("login_info.db")
-    # create cursor
-    cur = conn.cursor()
     # query records from the table of users
-    cur.execute("SELECT * FROM user")
-    rows = cur.fetchall()
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
+    return get_connection(USER_DB).execute("SELECT * FROM user").fetchall()
+
+
+# look up one user by name (an index lookup), returns (username, stored password) or None
+def get_user(username):
+    return get_connection(USER_DB).execute("SELECT username, password FROM user WHERE username=?",
+                                           (username,)).fetchone()
+
+
+# register a user unless the name is taken; returns whether the user was created
+# (the unique index decides, so two registrations racing for a name can't both succeed)
+def create_user(username, password):
+    # hash before taking the write lock
+    password = credentials.hash_password(password)
+    with transaction(USER_DB) as conn:
+        cursor = conn.execute("INSERT INTO user VALUES (?, ?) ON CONFLICT (username) DO NOTHING",
+                              (username, password))
+    return cursor.rowcount == 1
+
+
+# register a user together with their starting categories, both or neither; returns whether the user was
+# created (the login and the categories live in different databases, so a failure adding the categories
+# takes the login back out)
+def register_user(username, password, categories=START_CATEGORIES):
+    if not create_user(username, password):
+        return False
+    try:
+        with transaction(shard_for(username)) as conn:
+            conn.executemany("INSERT INTO categories VALUES (?, ?)",
+                             [(username, category) for category in categories])
+            _bump_version(conn, username)
+    except BaseException:
+        with transaction(USER_DB) as conn:
+            conn.execute("DELETE FROM user WHERE username=?", (username,))
+        raise
+    invalidate_cache("categories", username)
+    return True
+
+
+# check a login: None if there is no such user, otherwise whether the password is right
+# (a password stored as plain text or with an older hashing scheme is stored again with the current one)
+def verify_user(username, password):
+    record = get_user(username)
+    if record is None:
+        return None
+    stored = record[1]
+    matches, needs_rehash = credentials.verify_password(username, password, stored)
+    if matches and needs_rehash:
+        rehashed = credentials.hash_password(password)
+        with transaction(USER_DB) as conn:
+            # only if the password wasn't changed in the meantime
+            updated = conn.execute("UPDATE user SET password=? WHERE username=? AND password=?",
+                                   (rehashed, username, stored)).rowcount
+        if updated:
+            credentials.remember(username, password, rehashed)
+    return matches
+
+
+# replace a user's password
+def set_password(username, password):
+    password = credentials.hash_password(password)
+    with transaction(USER_DB) as conn:
+        conn.execute("UPDATE user SET password=? WHERE username=?", (password, username))
+    credentials.forget(username)
 
 # ----------------------------------------------------------------------------------------------
 
 
 # --------------------------------------------------- backend functions for login_info database
 
-def connect_categories():
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
+def connect_categories(db=None):
     # create table of categories
-    cur.execute("""CREATE TABLE IF NOT EXISTS categories (
-                user text,
-                category text
-                )""")
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    for db in _target_databases(db):
+        with transaction(db) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS categories (
+                    user text,
+                    category text
+                    )""")
 
 
 def insert_category(user, category):
-    # connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # insert category into table of categories
-    cur.execute("INSERT INTO categories VALUES (?, ?)", (user, category))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(shard_for(user)) as conn:
+        conn.execute("INSERT INTO categories VALUES (?, ?)", (user, category))
+        _bump_version(conn, user)
+    invalidate_cache("categories", user)
 
 
 # delete expense information
 def delete_category(user, category):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # delete category with certain name, as specified by the user
-    cur.execute("DELETE FROM categories WHERE user=? and category=?", (user, category))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(shard_for(user)) as conn:
+        conn.execute("DELETE FROM categories WHERE user=? and category=?", (user, category))
+        _bump_version(conn, user)
+    invalidate_cache("categories", user)
 
 
 def query_categories(user):
-    # connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
-    # query records from table of categories
-    cur.execute("SELECT * FROM categories WHERE user=?", (user,))
-    rows = cur.fetchall()
-    rows = [category[1] for category in rows]
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
+    # query records from table of categories in the order they were added (served from the cache after the
+    # first call; without the ORDER BY, rows would come back in the order of whichever index is used)
+    return _cached("categories", user, lambda: [
+        category[1] for category in get_connection(shard_for(user)).execute(
+            "SELECT * FROM categories WHERE user=? ORDER BY rowid", (user,))
+    ])
 
 
 # --------------------backend functions for expense database
-def connect_expense():
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
+def connect_expense(db=None):
     # create table of expenses
-    cur.execute("""CREATE TABLE IF NOT EXISTS expenses (
-                user text,
-                name text,
-                amount real,
-                category text,
-                date text,
-                id INTEGER PRIMARY KEY
-                )""")
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    for db in _target_databases(db):
+        with transaction(db) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS expenses (
+                    user text,
+                    name text,
+                    amount real,
+                    category text,
+                    date text,
+                    id INTEGER PRIMARY KEY
+                    )""")
 
 
 def insert_expense(user, name, amt, category, date):
-    # connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # insert expense information into expense table
-    cur.execute("INSERT INTO expenses VALUES (?, ?, ?, ?, ?, NULL)",
-                (user, name, amt, category, date))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(shard_for(user)) as conn:
+        cur = conn.execute("INSERT INTO expenses VALUES (?, ?, ?, ?, ?, NULL)",
+                           (user, name, to_cents(amt), category, to_day(date)))
+        _bump_version(conn, user)
+    invalidate_charts(user, to_day(date))
+    # id of the new expense
+    return cur.lastrowid
+
+
+def insert_expenses_bulk(user, rows):
+    # insert many (name, amount, category, date) rows in a single transaction
+    with transaction(shard_for(user)) as conn:
+        cur = conn.executemany("INSERT INTO expenses VALUES (?, ?, ?, ?, ?, NULL)",
+                               ((user, name, to_cents(amt), category, to_day(date))
+                                for name, amt, category, date in rows))
+        _bump_version(conn, user)
+    invalidate_charts(user)
+    return cur.rowcount
 
 
 def query_expense(user):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # query expenses from table of expenses
-    cur.execute("SELECT * FROM expenses WHERE user=?", (user,))
-    rows = cur.fetchall()
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
+    return get_connection(shard_for(user)).execute("SELECT * FROM expenses WHERE user=?", (user,)).fetchall()
 
 
 # delete expense information
-def delete_expense(oid):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
-    # delete expense with specific id
-    cur.execute("DELETE FROM expenses WHERE id=?", (oid,))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+def delete_expense(user, oid):
+    # delete the user's expense with specific id (ids are only unique within a shard)
+    with transaction(shard_for(user)) as conn:
+        old = conn.execute("SELECT day FROM expenses WHERE id=? AND user=?", (oid, user)).fetchone()
+        deleted = conn.execute("DELETE FROM expenses WHERE id=? AND user=?", (oid, user)).rowcount
+        _bump_version(conn, user)
+    if old is not None:
+        invalidate_charts(user, old[0])
+    # 0 if the user has no expense with that id
+    return deleted
 
 
 def update_expense(user, name, amt, category, date, oid):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # update expense information
-    cur.execute("""UPDATE expenses SET
-            user = :user,
-            name = :name,
-            amount = :amt,
-            category = :category,
-            date = :date
-
-            WHERE oid = :oid""",
-                {
-                    'user': user,
-                    'name': name,
-                    'amt': amt,
-                    'category': category,
-                    'date': date,
-                    'oid': oid
-                })
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-
-
-def sort_by(user, sort_method):
-    if sort_method == "date-added":
-        sort_method = "rowid"
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
+    with transaction(shard_for(user)) as conn:
+        old = conn.execute("SELECT day FROM expenses WHERE id=? AND user=?", (oid, user)).fetchone()
+        updated = conn.execute("""UPDATE expenses SET
+                name = :name,
+                amount_cents = :amt,
+                category = :category,
+                day = :day
+
+                WHERE oid = :oid AND user = :user""",
+                     {
+                         'user': user,
+                         'name': name,
+                         'amt': to_cents(amt),
+                         'category': category,
+                         'day': to_day(date),
+                         'oid': oid
+                     }).rowcount
+        _bump_version(conn, user)
+    # charts covering the expense's old and new dates are out of date
+    if old is not None:
+        invalidate_charts(user, old[0])
+    invalidate_charts(user, to_day(date))
+    # 0 if the user has no expense with that id
+    return updated
+
+
+# number of rows fetched at a time by tables that load as they are scrolled
+PAGE_SIZE = 200
+
+# positions of the expense columns in a fetched row
+EXPENSE_COLUMNS = {"user": 0, "name": 1, "amount_cents": 2, "category": 3, "day": 4, "id": 5}
+
+# sort method -> ordering used for keyset pagination (id is last so every row has a unique position)
+PAGE_ORDER = {
+    "name": ("name", "id"),
+    "category": ("category", "day", "id"),
+    "amount": ("amount_cents", "id"),
+    "date": ("day", "id"),
+    "date-added": ("id",),
+}
+
+
+SORT_DIRECTIONS = ("asc", "desc")
+
+
+def _order_by(sort_method, direction):
+    return ", ".join(f"{column} {direction.upper()}" for column in PAGE_ORDER[sort_method])
+
+
+# registries of the only query shapes sorting and paging can run, built once from the whitelisted orders
+# so the SQL text is identical on every call and each connection's statement cache hands back the
+# already prepared statement; (sort method, direction) -> query
+SORT_QUERIES = {
+    (sort_method, direction): f"SELECT * FROM expenses WHERE user=? ORDER BY {_order_by(sort_method, direction)}"
+    for sort_method in PAGE_ORDER for direction in SORT_DIRECTIONS
+}
+
+# (sort method, direction) -> (first page query, query for the page after a key)
+PAGE_QUERIES = {
+    (sort_method, direction): (
+        f"SELECT * FROM expenses WHERE user=? ORDER BY {_order_by(sort_method, direction)} LIMIT ?",
+        f"""SELECT * FROM expenses WHERE user=?
+                AND ({', '.join(columns)}) {'>' if direction == 'asc' else '<'} ({', '.join('?' * len(columns))})
+                ORDER BY {_order_by(sort_method, direction)} LIMIT ?""",
+    )
+    for sort_method, columns in PAGE_ORDER.items() for direction in SORT_DIRECTIONS
+}
+
+
+def _lookup_query(registry, sort_method, direction):
+    try:
+        return registry[sort_method, direction]
+    except KeyError:
+        raise ValueError(f"Unsupported sort: {sort_method!r} {direction!r}") from None
+
+
+def sort_by(user, sort_method, direction="asc"):
     # query expenses according to sort method
-    cur.execute(f"SELECT * FROM expenses WHERE user=? ORDER BY {sort_method}", (user,))
-    rows = cur.fetchall()
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
+    query = _lookup_query(SORT_QUERIES, sort_method, direction)
+    return get_connection(shard_for(user)).execute(query, (user,)).fetchall()
+
+
+# the position of a row in a sort order, passed back to fetch_expense_page to get the rows after it
+def page_key(sort_method, record):
+    return tuple(record[EXPENSE_COLUMNS[column]] for column in PAGE_ORDER[sort_method])
+
+
+# fetch the next page of expenses in sort order, starting after the row with key `after` (or from the top)
+def fetch_expense_page(user, sort_method, after=None, limit=PAGE_SIZE, direction="asc"):
+    first_page, next_page = _lookup_query(PAGE_QUERIES, sort_method, direction)
+    if after is None:
+        return get_connection(shard_for(user)).execute(first_page, (user, limit)).fetchall()
+    return get_connection(shard_for(user)).execute(next_page, (user, *after, limit)).fetchall()
 
 
+# yield a user's expenses in chunks straight off the cursor, optionally limited to
+# dates in [start, end) and/or one category
+def stream_expenses(user, start=None, end=None, category=None, sort_method="date-added", chunk_size=5000):
+    order = ", ".join(PAGE_ORDER[sort_method])
+    # the indexes that find rows by date and/or category walk them in date order; any other order would be
+    # sorted in memory before the first row came back, so filtered streams always come in date order
+    if start is not None or end is not None or category is not None:
+        order = ", ".join(PAGE_ORDER["date"])
+    conditions = ["user=?"]
+    params = [user]
+    if start is not None:
+        conditions.append("day >= ?")
+        params.append(to_day(start))
+    if end is not None:
+        conditions.append("day < ?")
+        params.append(to_day(end))
+    if category is not None:
+        conditions.append("category=?")
+        params.append(category)
+
+    cur = get_connection(shard_for(user)).execute(
+        f"SELECT * FROM expenses WHERE {' AND '.join(conditions)} ORDER BY {order}", params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+# a user's expenses with dates in [start, end), in date order
+# (bounds can be day numbers, dates or "YYYY-MM-DD" text)
+def fetch_expenses_between(user, start, end):
+    return get_connection(shard_for(user)).execute("""SELECT * FROM expenses WHERE user=? AND day >= ? AND day < ?
+                ORDER BY day, id""", (user, to_day(start), to_day(end))).fetchall()
+
+
+# a user's expenses for a month (or the whole year for "All Time")
 def fetch_expenses_from(user, month, year):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
-
-    if month != "All Time":
-        # convert date to a suitable format
-        datetime_obj = datetime.strptime(f'{year}-{month}', '%Y-%B')
-        formatted_date = datetime_obj.strftime('%Y-%m')
-        last_date_month = formatted_date + '-31'
-
-        cur.execute("SELECT * FROM expenses where date >= ? and date <= ? and user=? ORDER BY date",
-                    (formatted_date, last_date_month, user))
-    else:
-        current_year = int(year)
-        next_year = current_year + 1
-        current_year_obj = datetime.strptime(f'{str(current_year)}', '%Y')
-        next_year_obj = datetime.strptime(f'{str(next_year)}', '%Y')
-        cur.execute("SELECT * FROM expenses where date >= ? and date <= ? and user=? ORDER BY date",
-                    (current_year_obj, next_year_obj, user))
-
-    rows = cur.fetchall()
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
+    return fetch_expenses_between(user, *period_bounds(month, year))
 
 # ---------------------------------------------------
 
 
 # --------------------------------------------------- backend functions for budget database
-def connect_budget():
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
+def connect_budget(db=None):
     # create table of budgets
-    cur.execute("""CREATE TABLE IF NOT EXISTS budgets (
-                user text,
-                category text,
-                amount text,
-                id INTEGER PRIMARY KEY
-                )""")
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    for db in _target_databases(db):
+        with transaction(db) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS budgets (
+                    user text,
+                    category text,
+                    amount text,
+                    id INTEGER PRIMARY KEY
+                    )""")
 
 
 def insert_budget(user, category, amt):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # insert budget information into table of budgets
-    cur.execute("INSERT INTO budgets VALUES (?, ?, ?, NULL)", (user, category, amt))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(shard_for(user)) as conn:
+        cur = conn.execute("INSERT INTO budgets VALUES (?, ?, ?, NULL)", (user, category, to_cents(amt)))
+        _bump_version(conn, user)
+    invalidate_cache("budgets", user)
+    invalidate_charts(user, kinds=("bar",))
+    # id of the new budget
+    return cur.lastrowid
 
 
 def query_budgets(user):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
-    # query budgets records
-    cur.execute("SELECT * FROM budgets WHERE user=?", (user,))
-    rows = cur.fetchall()
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
-    return rows
-
-
-def delete_budget(oid):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
-    # delete records with specific id
-    cur.execute(f"DELETE FROM budgets WHERE id=?", (oid,))
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    # query budgets records in the order they were added, which is the order the Budget tab shows them in
+    # (served from the cache after the first call)
+    return _cached("budgets", user, lambda: get_connection(shard_for(user)).execute(
+        "SELECT * FROM budgets WHERE user=? ORDER BY id", (user,)).fetchall())
+
+
+def delete_budget(user, oid):
+    # delete the user's record with specific id
+    with transaction(shard_for(user)) as conn:
+        deleted = conn.execute("DELETE FROM budgets WHERE id=? AND user=?", (oid, user)).rowcount
+        _bump_version(conn, user)
+    invalidate_cache("budgets", user)
+    invalidate_charts(user, kinds=("bar",))
+    # 0 if the user has no budget with that id
+    return deleted
 
 
 def update_budget(user, category, amt, oid):
-    # create/connect to expense database
-    conn = sqlite3.connect("expenses.db")
-    # create cursor
-    cur = conn.cursor()
     # update a record with a certain id
-    cur.execute("""UPDATE budgets SET
-            user = :user,
-            category = :category,
-            amount = :amt
-
-            WHERE oid = :oid""",
-                {
-                    'user': user,
-                    'category': category,
-                    'amt': amt,
-                    'oid': oid
-                })
-    # commit changes
-    conn.commit()
-    # close database
-    conn.close()
+    with transaction(shard_for(user)) as conn:
+        updated = conn.execute("""UPDATE budgets SET
+                category = :category,
+                amount_cents = :amt
+
+                WHERE oid = :oid AND user = :user""",
+                     {
+                         'user': user,
+                         'category': category,
+                         'amt': to_cents(amt),
+                         'oid': oid
+                     }).rowcount
+        _bump_version(conn, user)
+    invalidate_cache("budgets", user)
+    invalidate_charts(user, kinds=("bar",))
+    # 0 if the user has no budget with that id
+    return updated
 
 
 # ---------------------------------------------------
 
+
+# --------------------------------------------------- aggregate queries
+
+# convert a month name (or "All Time") and a year into half-open [start, end) day number bounds
+def period_bounds(month, year):
+    year = int(year)
+    if month == "All Time":
+        return to_day(date(year, 1, 1)), to_day(date(year + 1, 1, 1))
+    month_number = datetime.strptime(month, '%B').month
+    start = date(year, month_number, 1)
+    end = date(year + month_number // 12, month_number % 12 + 1, 1)
+    return to_day(start), to_day(end)
+
+
+# the monthly_totals rollup can answer a query when both bounds fall on the first of a month
+def _month_aligned(start, end):
+    return from_day(start).day == 1 and from_day(end).day == 1
+
+
+# "YYYY-MM" key of the month a day falls in
+def _year_month(day):
+    return format_day(day)[:7]
+
+
+# total spent (in cents) per category between start (inclusive) and end (exclusive)
+def category_totals(user, start, end):
+    conn = get_connection(shard_for(user))
+    start, end = to_day(start), to_day(end)
+    if _month_aligned(start, end):
+        return conn.execute("""SELECT category, SUM(total_cents) FROM monthly_totals
+                    WHERE user=? AND year_month >= ? AND year_month < ?
+                    GROUP BY category""", (user, _year_month(start), _year_month(end))).fetchall()
+    return conn.execute("""SELECT category, SUM(amount_cents) FROM expenses
+                WHERE user=? AND day >= ? AND day < ?
+                GROUP BY category""", (user, start, end)).fetchall()
+
+
+# (category, budget, spent) in cents for each of the user's budgets between start (inclusive) and end (exclusive)
+def budget_vs_spent(user, start, end):
+    conn = get_connection(shard_for(user))
+    start, end = to_day(start), to_day(end)
+    if _month_aligned(start, end):
+        return conn.execute("""SELECT b.category, b.amount_cents, COALESCE(SUM(m.total_cents), 0)
+                    FROM budgets b
+                    LEFT JOIN monthly_totals m
+                        ON m.user = b.user AND m.category = b.category
+                        AND m.year_month >= ? AND m.year_month < ?
+                    WHERE b.user=?
+                    GROUP BY b.id
+                    ORDER BY b.id""", (_year_month(start), _year_month(end), user)).fetchall()
+    return conn.execute("""SELECT b.category, b.amount_cents, COALESCE(SUM(e.amount_cents), 0)
+                FROM budgets b
+                LEFT JOIN expenses e
+                    ON e.user = b.user AND e.category = b.category AND e.day >= ? AND e.day < ?
+                WHERE b.user=?
+                GROUP BY b.id
+                ORDER BY b.id""", (start, end, user)).fetchall()
+
+
+# total spent (in cents) on each day with expenses between start (inclusive) and end (exclusive),
+# as (day number, total) in date order
+def daily_totals(user, start, end):
+    return get_connection(shard_for(user)).execute("""SELECT day, SUM(amount_cents) FROM expenses
+                WHERE user=? AND day >= ? AND day < ?
+                GROUP BY day ORDER BY day""", (user, to_day(start), to_day(end))).fetchall()
+
+
+# --------------------------------------------------- chart series cache
+
+# the aggregated series behind each chart in the Stats tab
+CHART_SERIES = {
+    "bar": budget_vs_spent,
+    "pie": category_totals,
+    "line": daily_totals,
+}
+
+# number of series kept, least recently used are dropped first
+CHART_CACHE_SIZE = 64
+
+# (database, user, start, end, kind) -> (version of the user's data, series), most recently used last
+_chart_cache = OrderedDict()
+_chart_lock = threading.Lock()
+# bumped by every invalidation, so a series computed while a write landed isn't cached
+_chart_generation = 0
+_chart_stats = {"hits": 0, "misses": 0}
+
+
+# the series for a chart kind over [start, end), from the cache when the period hasn't changed since
+def chart_series(user, start, end, kind):
+    start, end = to_day(start), to_day(end)
+    db = shard_for(user)
+    conn = get_connection(db)
+    # inside a transaction the series may include uncommitted writes, which mustn't be shared
+    if conn.in_transaction:
+        return list(CHART_SERIES[kind](user, start, end))
+    # served while the user's data is at the version it was computed from (see the read cache)
+    version = _user_version(conn, user)
+    key = (db, user, start, end, kind)
+    with _chart_lock:
+        entry = _chart_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _chart_cache.move_to_end(key)
+            _chart_stats["hits"] += 1
+            return list(entry[1])
+        _chart_stats["misses"] += 1
+        generation = _chart_generation
+    series = tuple(CHART_SERIES[kind](user, start, end))
+    with _chart_lock:
+        if generation == _chart_generation:
+            _chart_cache[key] = (version, series)
+            _chart_cache.move_to_end(key)
+            if len(_chart_cache) > CHART_CACHE_SIZE:
+                _chart_cache.popitem(last=False)
+    return list(series)
+
+
+# drop cached series for a user (None: every user) whose period contains day (None: any period),
+# optionally only some chart kinds
+def invalidate_charts(user=None, day=None, kinds=None):
+    global _chart_generation
+    if _defer_invalidation(invalidate_charts, user, day, kinds):
+        return
+    with _chart_lock:
+        _chart_generation += 1
+        for key in list(_chart_cache):
+            _, key_user, start, end, kind = key
+            if ((user is None or key_user == user) and (day is None or start <= day < end)
+                    and (kinds is None or kind in kinds)):
+                del _chart_cache[key]
+
+
+# hit/miss counters and the number of cached series
+def chart_cache_info():
+    with _chart_lock:
+        return {**_chart_stats, "entries": len(_chart_cache)}
+
+
+# --------------------------------------------------- monthly rollup maintenance
+
+# the rollup computed from scratch: (user, year_month, category) -> (total cents, count)
+def _expected_monthly_totals(conn):
+    rows = conn.execute("""SELECT user, strftime('%Y-%m', day + 2440587.5) AS year_month, category, SUM(amount_cents), COUNT(*)
+                FROM expenses GROUP BY user, year_month, category""")
+    return {(user, year_month, category): (total, count) for user, year_month, category, total, count in rows}
+
+
+def _rebuild_monthly_totals(conn):
+    conn.execute("DELETE FROM monthly_totals")
+    conn.execute("""INSERT INTO monthly_totals
+                SELECT user, strftime('%Y-%m', day + 2440587.5) AS year_month, category, SUM(amount_cents), COUNT(*)
+                FROM expenses GROUP BY user, year_month, category""")
+
+
+# recompute the whole rollup from the expenses table (in every shard)
+def rebuild_monthly_totals():
+    for db in shards():
+        with transaction(db) as conn:
+            _rebuild_monthly_totals(conn)
+            # month-aligned chart series are read from the rollup
+            conn.execute("UPDATE user_versions SET version = version + 1")
+
+
+# list rows where the rollup has drifted from the expenses table (in any shard)
+# as (user, year_month, category, stored (total, count), expected (total, count))
+def verify_monthly_totals():
+    expected = {}
+    stored = {}
+    # a user's rows are all in one shard, so the keys of different shards never collide
+    for db in shards():
+        with transaction(db, write=False) as conn:
+            expected.update(_expected_monthly_totals(conn))
+            stored.update(((user, year_month, category), (total, count)) for user, year_month, category, total, count
+                          in conn.execute("SELECT * FROM monthly_totals"))
+
+    drift = []
+    for key in sorted(expected.keys() | stored.keys()):
+        stored_total, stored_count = stored.get(key, (0, 0))
+        expected_total, expected_count = expected.get(key, (0, 0))
+        if stored_count != expected_count or stored_total != expected_total:
+            drift.append((*key, stored.get(key), expected.get(key)))
+    return drift
+
+# ---------------------------------------------------
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import analytics
+import credentials
+from backend import *
+
+
+# Benchmarks for the backend queries and the analytics built on them, run against generated data.
+#
+#   python benchmark.py --sizes 1000 100000 1000000 --output results.json
+#   python benchmark.py --output new.json --compare results.json
+#
+# Every size gets a fresh pair of database files in a temporary directory. Each operation is timed
+# over repeated calls (ops/sec, p50/p99 latency), then run once more under tracemalloc for its peak
+# Python memory (SQLite's own allocations aren't included).
+
+SIZES = (1_000, 100_000, 1_000_000)
+USERS = 10
+YEARS = 3
+SEED = 1234
+
+# generated data ends here, so the same seed always gives the same rows
+LAST_DAY = date(2024, 12, 31)
+
+# rows inserted per bulk insert while generating
+GENERATE_CHUNK = 10_000
+
+# each operation runs for about this long (at least MIN_RUNS and at most MAX_RUNS times)
+TIME_BUDGET = 1.0
+MIN_RUNS = 3
+MAX_RUNS = 1000
+
+EXPENSE_NAMES = ("Groceries", "Coffee", "Rent", "Fuel", "Cinema", "Books", "Pharmacy", "Gym", "Taxi", "Phone",
+                 "Internet", "Restaurant", "Flight", "Hotel", "Toys", "Tuition", "Insurance", "Gift")
+
+
+def user_name(index):
+    return f"user{index:04d}"
+
+
+# deterministic synthetic expenses: rows (user, name, amount in dollars, category, "YYYY-MM-DD")
+# spread over `users` users, the last `years` years and the START_CATEGORIES
+def generate_expenses(rows, users=USERS, years=YEARS, seed=SEED):
+    rng = random.Random(seed)
+    last = to_day(LAST_DAY)
+    first = last - 365 * years + 1
+    for _ in range(rows):
+        # mostly small amounts with the odd large one, in whole cents
+        cents = max(1, int(rng.lognormvariate(7, 1.2)))
+        yield (user_name(rng.randrange(users)), rng.choice(EXPENSE_NAMES), cents / 100,
+               rng.choice(START_CATEGORIES), format_day(rng.randint(first, last)))
+
+
+# fill the current databases: a login, the starting categories and a budget for each category per user,
+# then `rows` expenses
+def populate(rows, users=USERS, years=YEARS, seed=SEED):
+    prepare_databases()
+
+    rng = random.Random(seed + 1)
+    for index in range(users):
+        user = user_name(index)
+        insert_user(user, "benchmark")
+        for category in START_CATEGORIES:
+            insert_category(user, category)
+            insert_budget(user, category, rng.randint(50, 2000))
+
+    # insert_expenses_bulk takes one user's rows at a time (each batch is committed on its own, as users
+    # may be stored in different files)
+    pending = {}
+    for user, name, amount, category, day in generate_expenses(rows, users, years, seed):
+        batch = pending.setdefault(user, [])
+        batch.append((name, amount, category, day))
+        if len(batch) >= GENERATE_CHUNK:
+            insert_expenses_bulk(user, batch)
+            batch.clear()
+    for user, batch in pending.items():
+        if batch:
+            insert_expenses_bulk(user, batch)
+
+
+# the operations to time as name -> function of no arguments (inserts go to `insert_user`, so the
+# other operations see the same rows however many inserts were timed)
+def operations(user, insert_user):
+    year = LAST_DAY.year
+    month = period_bounds("March", year)
+    whole_year = period_bounds("All Time", year)
+    # a window that doesn't start on the first of a month can't use the monthly rollup
+    unaligned = (month[0] + 3, whole_year[1])
+    insert_day = format_day(month[0])
+
+    def uncached(func):
+        # drop cached chart series first, so the database is read every time
+        def run():
+            invalidate_charts()
+            return func()
+        return run
+
+    def fresh_login():
+        # forget verified logins first, so the password is hashed every time
+        credentials.forget()
+        return verify_user(user, "benchmark")
+
+    ops = {
+        "verify_user": fresh_login,
+        "verify_user (cached)": lambda: verify_user(user, "benchmark"),
+        "insert_expense": lambda: insert_expense(insert_user, "Benchmark", 9.99, START_CATEGORIES[0], insert_day),
+        "query_expense": lambda: query_expense(user),
+        "query_categories (cached)": lambda: query_categories(user),
+        "query_budgets (cached)": lambda: query_budgets(user),
+        "fetch_expenses_from month": lambda: fetch_expenses_from(user, "March", year),
+        "fetch_expenses_from year": lambda: fetch_expenses_from(user, "All Time", year),
+        "fetch_expense_page date": lambda: fetch_expense_page(user, "date"),
+        "category_totals month (rollup)": lambda: category_totals(user, *month),
+        "category_totals unaligned (raw)": lambda: category_totals(user, *unaligned),
+        "savings budget_report": uncached(lambda: analytics.budget_report(user, *analytics.current_month(LAST_DAY))),
+        "savings budget_report (cached)": lambda: analytics.budget_report(user, *analytics.current_month(LAST_DAY)),
+        "spending_distribution year": uncached(lambda: analytics.spending_distribution(user, *whole_year)),
+        "spending_over_time year": uncached(lambda: analytics.spending_over_time(user, *whole_year)),
+    }
+    for sort_method in PAGE_ORDER:
+        ops[f"sort_by {sort_method}"] = lambda sort_method=sort_method: sort_by(user, sort_method)
+    return ops
+
+
+# the latency below which `fraction` of the samples fall (also used by stress.py and loadtest.py)
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+# time one operation, returns its result entry
+def measure(name, func, time_budget=TIME_BUDGET):
+    func()  # warm up (statement cache, page cache)
+
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < MAX_RUNS and (len(latencies) < MIN_RUNS or time.perf_counter() - started < time_budget):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "operation": name,
+        "runs": len(latencies),
+        "ops_per_sec": round(len(latencies) / sum(latencies), 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+# generate `rows` expenses in a scratch directory and time every operation against them
+def run_size(rows, users=USERS, years=YEARS, seed=SEED, time_budget=TIME_BUDGET, only=None, sharding="",
+             progress=print):
+    with tempfile.TemporaryDirectory(prefix="expense-bench-") as directory:
+        use_databases(os.path.join(directory, "expenses.db"), os.path.join(directory, "login_info.db"),
+                      sharding=sharding, shard_dir=os.path.join(directory, "shards"))
+        try:
+            started = time.perf_counter()
+            populate(rows, users, years, seed)
+            progress(f"{rows:,} rows generated in {time.perf_counter() - started:.1f}s")
+
+            results = []
+            for name, func in operations(user_name(0), user_name(users)).items():
+                if only and not any(part in name for part in only):
+                    continue
+                result = measure(name, func, time_budget)
+                result["rows"] = rows
+                results.append(result)
+                progress(f"  {name:<34} {result['ops_per_sec']:>12,.1f} ops/s   p50 {result['p50_ms']:9.3f} ms   "
+                         f"p99 {result['p99_ms']:9.3f} ms   peak {result['peak_kb']:9.1f} KB")
+            return results
+        finally:
+            close_connections()
+
+
+# the commit being benchmarked, if this is a git checkout
+def code_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# print the change in ops/sec for every (rows, operation) found in both result files
+def compare(previous, current, progress=print):
+    before = {(result["rows"], result["operation"]): result for result in previous["results"]}
+    progress(f"\ncompared with {previous.get('version') or 'previous run'} ({previous.get('timestamp')}):")
+    for result in current["results"]:
+        old = before.get((result["rows"], result["operation"]))
+        if old is None:
+            continue
+        change = (result["ops_per_sec"] / old["ops_per_sec"] - 1) * 100
+        progress(f"  {result['rows']:>9,} {result['operation']:<34} {old['ops_per_sec']:>12,.1f} -> "
+                 f"{result['ops_per_sec']:>12,.1f} ops/s ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Expense Tracker backend and analytics operations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of expense rows to test with")
+    parser.add_argument("--users", type=int, default=USERS)
+    parser.add_argument("--years", type=int, default=YEARS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET, help="seconds spent timing each operation")
+    parser.add_argument("--only", nargs="+", help="only run operations whose name contains one of these")
+    parser.add_argument("--sharding", default="", help="'user' or a number of files (default: one database file)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "version": code_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "users": args.users,
+        "years": args.years,
+        "seed": args.seed,
+        "sharding": args.sharding,
+        "results": [],
+    }
+    for rows in args.sizes:
+        report["results"].extend(run_size(rows, args.users, args.years, args.seed, args.time_budget, args.only,
+                                          args.sharding))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
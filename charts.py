@@ -0,0 +1,73 @@
+from tkinter import Toplevel, BOTH, TOP
+
+
+# matplotlib takes a while to import, so it is loaded (and styled) when the first chart is created
+_matplotlib_ready = False
+
+
+def _load_matplotlib():
+    global _matplotlib_ready
+    if not _matplotlib_ready:
+        import matplotlib
+        from matplotlib import style
+        matplotlib.use('TkAgg')
+        style.use("ggplot")
+        _matplotlib_ready = True
+
+
+# a chart shown in its own window; the figure, canvas and window are created once and reused,
+# so showing new data only updates the artists already on the axes
+class ChartWindow:
+    def __init__(self, master, title, figsize):
+        _load_matplotlib()
+        from matplotlib.figure import Figure
+
+        self._master = master
+        self._title = title
+        # a plain Figure (not pyplot), so nothing piles up in pyplot's figure manager
+        self.figure = Figure(figsize=figsize, dpi=100)
+        self.axes = self.figure.add_subplot()
+        # named artists kept between updates (bars, lines, wedges...)
+        self.artists = {}
+        self._window = None
+        self._canvas = None
+
+    # bring the window up (creating it the first time) and redraw the figure when Tk is idle
+    def show(self):
+        if self._window is None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+            self._window = Toplevel(self._master)
+            self._window.title(self._title)
+            # closing only hides the window so the next chart reuses it
+            self._window.protocol("WM_DELETE_WINDOW", self._window.withdraw)
+            self._canvas = FigureCanvasTkAgg(self.figure, master=self._window)
+            NavigationToolbar2Tk(self._canvas, self._window).update()
+            self._canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=True)
+        else:
+            self._window.deiconify()
+            self._window.lift()
+        self._canvas.draw_idle()
+
+    # rescale the axes to the updated artists
+    def rescale(self):
+        self.axes.relim()
+        self.axes.autoscale_view()
+
+
+# update a bar series in place: bars get new heights (widths when horizontal) and are only rebuilt
+# when the number of bars changes; returns the bars now on the axes
+def set_bars(axes, bars, positions, values, horizontal=False, **style):
+    if bars is not None and len(bars) == len(values):
+        for bar, value in zip(bars, values):
+            if horizontal:
+                bar.set_width(value)
+            else:
+                bar.set_height(value)
+        return bars
+
+    if bars is not None:
+        bars.remove()
+    if horizontal:
+        return axes.barh(positions, values, **style)
+    return axes.bar(positions, values, **style)
@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Password hashing for the login database. A stored password looks like
+#
+#   scrypt$16384$8$1$<salt hex>$<hash hex>          (cost n, block size r, parallelism p)
+#   pbkdf2_sha256$600000$<salt hex>$<hash hex>      (iterations)
+#
+# and everything before the salt is the hashing scheme. The scheme new hashes use is SCHEME, which can be
+# set with the EXPENSE_PASSWORD_HASH environment variable (e.g. "scrypt$32768$8$1", see calibrate()).
+# Passwords stored by older versions (plain text) or with another scheme still verify, and are reported
+# as needing a rehash so the caller can store them again with the current scheme.
+
+# the parameters each algorithm's scheme string carries after its name
+ALGORITHMS = {"scrypt": ("n", "r", "p"), "pbkdf2_sha256": ("iterations",)}
+
+# ~50ms per hash on a typical laptop (scrypt needs OpenSSL 1.1+, PBKDF2 is always available)
+DEFAULT_SCHEME = "scrypt$16384$8$1" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256$600000"
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# a successful check is remembered this long (seconds), so logging in again in the same process
+# doesn't pay for the hash again
+VERIFIED_TTL = 300
+VERIFIED_CACHE_SIZE = 1024
+
+
+# split a scheme string into (algorithm, {parameter: int}); raises ValueError if it isn't one
+def parse_scheme(scheme):
+    algorithm, *values = scheme.split("$")
+    names = ALGORITHMS.get(algorithm)
+    if names is None or len(values) != len(names):
+        raise ValueError(f"unknown password hashing scheme: {scheme!r}")
+    params = dict(zip(names, map(int, values)))
+    if min(params.values()) < 1:
+        raise ValueError(f"invalid password hashing parameters: {scheme!r}")
+    return algorithm, params
+
+
+SCHEME = os.environ.get("EXPENSE_PASSWORD_HASH") or DEFAULT_SCHEME
+parse_scheme(SCHEME)
+
+
+# change the scheme new hashes use (stored hashes with other schemes are upgraded on their next login)
+def configure(scheme):
+    global SCHEME
+    parse_scheme(scheme)
+    SCHEME = scheme
+
+
+def _derive(password, salt, algorithm, params):
+    password = password.encode()
+    if algorithm == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        # scrypt needs ~128 * n * r bytes; allow that (plus slack) rather than OpenSSL's 32MB default
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+    return hashlib.pbkdf2_hmac("sha256", password, salt, params["iterations"], HASH_BYTES)
+
+
+# salted hash of a password, in the stored format
+def hash_password(password, scheme=None):
+    scheme = scheme or SCHEME
+    algorithm, params = parse_scheme(scheme)
+    salt = os.urandom(SALT_BYTES)
+    return f"{scheme}${salt.hex()}${_derive(password, salt, algorithm, params).hex()}"
+
+
+# split a stored password into (scheme, salt, hash), or None if it was stored as plain text
+def _split_stored(stored):
+    scheme, _, rest = stored.rpartition("$")
+    scheme, _, salt = scheme.rpartition("$")
+    try:
+        parse_scheme(scheme)
+        return scheme, bytes.fromhex(salt), bytes.fromhex(rest)
+    except ValueError:
+        return None
+
+
+# --------------------------------------------------- verified cache
+
+# (username, stored password) -> (keyed digest of the password, expiry time); the digest key only lives in
+# this process, so the cache never holds anything that could be checked against passwords elsewhere
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+_verified_key = os.urandom(32)
+
+
+def _digest(password):
+    return hmac.new(_verified_key, password.encode(), hashlib.sha256).digest()
+
+
+def _recently_verified(username, password, stored):
+    with _verified_lock:
+        entry = _verified.get((username, stored))
+        if entry is None:
+            return False
+        digest, expires = entry
+        if expires < time.monotonic():
+            del _verified[(username, stored)]
+            return False
+        return hmac.compare_digest(digest, _digest(password))
+
+
+# remember a successful check of this stored password (verify_password does this itself)
+def remember(username, password, stored):
+    with _verified_lock:
+        _verified[(username, stored)] = (_digest(password), time.monotonic() + VERIFIED_TTL)
+        _verified.move_to_end((username, stored))
+        while len(_verified) > VERIFIED_CACHE_SIZE:
+            _verified.popitem(last=False)
+
+
+# drop remembered logins for one user, or everyone
+def forget(username=None):
+    with _verified_lock:
+        for key in list(_verified):
+            if username is None or key[0] == username:
+                del _verified[key]
+
+# ----------------------------------------------------------------------------------------------
+
+
+# check a password against its stored form, returns (matches, needs_rehash); needs_rehash is True when it
+# matches but was stored as plain text or with a scheme other than SCHEME
+def verify_password(username, password, stored):
+    parts = _split_stored(stored)
+    if parts is None:
+        # stored before passwords were hashed
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+    scheme, salt, expected = parts
+
+    if _recently_verified(username, password, stored):
+        return True, scheme != SCHEME
+    algorithm, params = parse_scheme(scheme)
+    if not hmac.compare_digest(_derive(password, salt, algorithm, params), expected):
+        return False, False
+    remember(username, password, stored)
+    return True, scheme != SCHEME
+
+
+# the cheapest scheme of an algorithm whose hash takes at least target seconds on this machine
+# (scrypt doubles n, PBKDF2 scales its iterations from a timed run)
+def calibrate(target=0.1, algorithm=None):
+    algorithm = algorithm or parse_scheme(DEFAULT_SCHEME)[0]
+
+    def timed(scheme):
+        started = time.perf_counter()
+        hash_password("calibration", scheme)
+        return time.perf_counter() - started
+
+    if algorithm == "scrypt":
+        n = 2 ** 12
+        while timed(f"scrypt${n}$8$1") < target and n < 2 ** 24:
+            n *= 2
+        return f"scrypt${n}$8$1"
+    if algorithm == "pbkdf2_sha256":
+        sample = 100_000
+        elapsed = min(timed(f"pbkdf2_sha256${sample}") for _ in range(3))
+        return f"pbkdf2_sha256${max(sample, int(sample * target / elapsed))}"
+    raise ValueError(f"unknown password hashing algorithm: {algorithm!r}")
@@ -0,0 +1,54 @@
+import csv
+import gzip
+
+from backend import format_cents, format_day, query_budgets, stream_expenses
+
+
+# rows read from the database at a time
+CHUNK_SIZE = 5000
+
+# write buffer for uncompressed files
+BUFFER_SIZE = 1 << 20
+
+EXPENSE_HEADER = ["Name", "Amount", "Category", "Date", "ID"]
+BUDGET_HEADER = ["Category", "Amount", "ID"]
+
+
+# open an export file for writing, gzip-compressed if asked for or if the name ends in .gz
+def open_export(path, compress=None):
+    if compress is None:
+        compress = path.lower().endswith(".gz")
+    if compress:
+        return gzip.open(path, mode='wt', newline='', compresslevel=6)
+    return open(path, mode='w', newline='', buffering=BUFFER_SIZE)
+
+
+# tab separated for .tsv files, comma separated otherwise
+def delimiter_for(path):
+    return '\t' if path.lower().removesuffix(".gz").endswith(".tsv") else ','
+
+
+# stream a user's expenses into a csv/tsv file, returns the number of rows written
+# sort_method only applies to unfiltered exports, filtered ones come out in date order
+def export_expenses(user, path, start=None, end=None, category=None, sort_method="date-added", compress=None,
+                    progress=None, chunk_size=CHUNK_SIZE):
+    count = 0
+    with open_export(path, compress) as file:
+        writer = csv.writer(file, delimiter=delimiter_for(path))
+        writer.writerow(EXPENSE_HEADER)
+        for rows in stream_expenses(user, start, end, category, sort_method, chunk_size):
+            writer.writerows((row[1], format_cents(row[2]), row[3], format_day(row[4]), row[5]) for row in rows)
+            count += len(rows)
+            if progress is not None:
+                progress(count)
+    return count
+
+
+# write a user's budgets into a csv/tsv file, returns the number of rows written
+def export_budgets(user, path, compress=None):
+    budgets = query_budgets(user)
+    with open_export(path, compress) as file:
+        writer = csv.writer(file, delimiter=delimiter_for(path))
+        writer.writerow(BUDGET_HEADER)
+        writer.writerows((row[1], format_cents(row[2]), row[3]) for row in budgets)
+    return len(budgets)
@@ -0,0 +1,122 @@
+import csv
+import gzip
+import time
+from datetime import datetime
+from itertools import islice
+
+from backend import insert_expenses_bulk, shard_for, transaction
+from exporter import delimiter_for
+
+
+# number of rows handed to the database at a time
+CHUNK_SIZE = 5000
+
+# date formats accepted in imported files (the first one is what export_data writes)
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%y', '%m/%d/%Y', '%d/%m/%Y', '%Y%m%d')
+
+
+def parse_date(text):
+    text = text.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {text!r}")
+
+
+def parse_amount(text):
+    # strip currency symbols and thousands separators before converting
+    return float(text.strip().replace('$', '').replace(',', ''))
+
+
+# open a file for importing, decompressing it on the fly if the name ends in .gz (the counterpart of open_export)
+def open_import(path):
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, mode='rt', newline='')
+    return open(path, newline='')
+
+
+# read expenses from a .csv/.tsv/.txt file (optionally .gz compressed) with a header row
+# (same layout as the exported tables)
+def read_csv_rows(path, default_category):
+    with open_import(path) as file:
+        if delimiter_for(path) == '\t':
+            dialect = csv.excel_tab
+        else:
+            # work out the delimiter from the start of the file
+            sample = file.read(4096)
+            file.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',\t;')
+            except csv.Error:
+                dialect = csv.excel
+
+        reader = csv.reader(file, dialect)
+        header = [column.strip().lower() for column in next(reader, [])]
+        try:
+            name_col = header.index("name")
+            amount_col = header.index("amount")
+            date_col = header.index("date")
+        except ValueError:
+            raise ValueError("File must have Name, Amount and Date columns")
+        category_col = header.index("category") if "category" in header else None
+
+        for line_number, row in enumerate(reader, start=2):
+            # skip blank lines
+            if not row:
+                continue
+            try:
+                category = row[category_col].strip() if category_col is not None else ""
+                yield (row[name_col].strip(), parse_amount(row[amount_col]),
+                       category or default_category, parse_date(row[date_col]))
+            except (IndexError, ValueError) as error:
+                raise ValueError(f"Line {line_number}: {error}")
+
+
+# read expenses (debits) from an OFX/QFX bank statement
+def read_ofx_rows(path, default_category):
+    transaction_info = None
+    with open(path, errors='replace') as file:
+        for line in file:
+            # OFX is SGML-like, tags may share a line or have one per line
+            for token in line.split('<')[1:]:
+                tag, _, value = token.partition('>')
+                tag = tag.strip().upper()
+                value = value.strip()
+
+                if tag == "STMTTRN":
+                    transaction_info = {}
+                elif tag == "/STMTTRN" and transaction_info is not None:
+                    amount = parse_amount(transaction_info.get("TRNAMT", "0"))
+                    # only money going out counts as an expense
+                    if amount < 0:
+                        name = transaction_info.get("NAME") or transaction_info.get("MEMO") or "Imported"
+                        yield name, -amount, default_category, parse_date(transaction_info["DTPOSTED"][:8])
+                    transaction_info = None
+                elif transaction_info is not None and value:
+                    transaction_info[tag] = value
+
+
+# import expenses from a file in chunks, returns (rows imported, rows per second)
+def import_expenses(user, path, default_category="Uncategorized", chunk_size=CHUNK_SIZE, progress=None):
+    if path.lower().endswith(('.ofx', '.qfx')):
+        rows = read_ofx_rows(path, default_category)
+    else:
+        rows = read_csv_rows(path, default_category)
+
+    count = 0
+    start = time.perf_counter()
+    # the whole file goes in or nothing does
+    with transaction(shard_for(user)):
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            insert_expenses_bulk(user, chunk)
+            count += len(chunk)
+            if progress is not None:
+                progress(count)
+    elapsed = time.perf_counter() - start
+
+    return count, count / elapsed if elapsed > 0 else float(count)
@@ -0,0 +1,215 @@
+import argparse
+import base64
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import backend
+import server
+from benchmark import percentile
+
+
+# Load test for the HTTP API (server.py): client threads on kept-alive connections send a mix of reads and
+# writes for a while, then the throughput and latency of each kind of request are reported, along with
+# bulk loading (single requests vs /batch) and streaming a full export.
+#
+#   python loadtest.py --clients 8 --seconds 10                   (starts a server on scratch databases)
+#   python loadtest.py --url http://127.0.0.1:8765 --clients 8    (an already running server)
+
+CLIENTS = 8
+SECONDS = 5.0
+SEED_ROWS = 5_000
+BATCH_SIZE = 200
+USERNAME = "loadtest"
+PASSWORD = "loadtest"
+
+# request kind -> share of the mix
+MIX = {"page": 0.5, "insert": 0.2, "totals": 0.15, "budgets": 0.1, "update": 0.05}
+
+
+class Client:
+    def __init__(self, url, username=USERNAME, password=PASSWORD):
+        parts = urlsplit(url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self._headers = {"Authorization": f"Basic {token}", "Content-Type": "application/json"}
+
+    # send a request, returns (status, decoded JSON)
+    def request(self, method, path, body=None):
+        self._connection.request(method, path, None if body is None else json.dumps(body), self._headers)
+        response = self._connection.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+
+    def close(self):
+        self._connection.close()
+
+
+def random_expense(rng):
+    return {"name": rng.choice(("Coffee", "Groceries", "Fuel", "Books")), "amount": rng.randint(100, 10000) / 100,
+            "category": rng.choice(("Home", "Travel", "Food & Dining")),
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"}
+
+
+# register the load test user (fine if it exists) and give it budgets
+def set_up(url):
+    client = Client(url)
+    status, _ = client.request("POST", "/users", {"username": USERNAME, "password": PASSWORD})
+    if status not in (200, 409):
+        raise SystemExit(f"couldn't register {USERNAME}: HTTP {status}")
+    client.request("POST", "/batch", {"requests": [
+        {"method": "POST", "path": "/budgets", "body": {"category": category, "amount": 500}}
+        for category in ("Home", "Travel", "Food & Dining")]})
+    client.close()
+
+
+# load `rows` expenses one request at a time or in /batch requests, returns rows per second
+def bulk_load(url, rows, batch_size, rng):
+    client = Client(url)
+    started = time.perf_counter()
+    if batch_size <= 1:
+        for _ in range(rows):
+            client.request("POST", "/expenses", random_expense(rng))
+    else:
+        for first in range(0, rows, batch_size):
+            status, result = client.request("POST", "/batch", {"requests": [
+                {"method": "POST", "path": "/expenses", "body": random_expense(rng)}
+                for _ in range(min(batch_size, rows - first))]})
+            if status != 200:
+                raise SystemExit(f"batch failed: HTTP {status} {result}")
+    elapsed = time.perf_counter() - started
+    client.close()
+    return rows / elapsed
+
+
+# stream every expense, returns (rows, rows per second)
+def export_all(url):
+    client = Client(url)
+    started = time.perf_counter()
+    status, rows = client.request("GET", "/expenses?sort=date")
+    elapsed = time.perf_counter() - started
+    client.close()
+    return len(rows), len(rows) / elapsed
+
+
+# one client thread: sends requests from the mix until the deadline, recording (kind, status, latency)
+def run_client(url, deadline, seed, records):
+    rng = random.Random(seed)
+    client = Client(url)
+    kinds, weights = zip(*MIX.items())
+    mine = []
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        started = time.perf_counter()
+        if kind == "page":
+            query = {"sort": rng.choice(("date", "amount", "name")), "limit": 50,
+                     "direction": rng.choice(("asc", "desc"))}
+            status, _ = client.request("GET", f"/expenses/page?{urlencode(query)}")
+        elif kind == "insert":
+            status, result = client.request("POST", "/expenses", random_expense(rng))
+            if status == 200:
+                mine.append(result["id"])
+        elif kind == "totals":
+            query = {"month": rng.choice(("March", "All Time")), "year": 2024}
+            status, _ = client.request("GET", f"/totals/categories?{urlencode(query)}")
+        elif kind == "budgets":
+            status, _ = client.request("GET", "/totals/budgets?month=June&year=2024")
+        elif mine:
+            status, _ = client.request("PUT", f"/expenses/{rng.choice(mine)}", random_expense(rng))
+        else:
+            continue
+        records.append((kind, status, time.perf_counter() - started))
+    client.close()
+
+
+# a free port on this machine for the scratch server
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _serve_scratch(directory, port, workers):
+    backend.use_databases(os.path.join(directory, "expenses.db"), os.path.join(directory, "login_info.db"))
+    server.serve("127.0.0.1", port, workers)
+
+
+def wait_for(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((parts.hostname, parts.port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"no server at {url}")
+
+
+def run(url, clients=CLIENTS, seconds=SECONDS, seed_rows=SEED_ROWS, batch_size=BATCH_SIZE, progress=print):
+    rng = random.Random(1234)
+    set_up(url)
+
+    single_rows = max(1, seed_rows // 20)
+    progress(f"bulk load: {bulk_load(url, single_rows, 1, rng):,.0f} rows/s one request each, "
+             f"{bulk_load(url, seed_rows, batch_size, rng):,.0f} rows/s in batches of {batch_size}")
+    rows, rate = export_all(url)
+    progress(f"streamed export: {rows:,} rows at {rate:,.0f} rows/s")
+
+    records = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=run_client, args=(url, deadline, index, records)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    errors = sum(1 for kind, status, latency in records if status != 200)
+    progress(f"{clients} clients, {seconds:g}s: {len(records):,} requests, {len(records) / seconds:,.1f} req/s, "
+             f"{errors:,} errors")
+    for kind in MIX:
+        latencies = [latency for record_kind, status, latency in records if record_kind == kind]
+        if latencies:
+            progress(f"  {kind:<8} {len(latencies) / seconds:>10,.1f} req/s   "
+                     f"p50 {percentile(latencies, 0.5) * 1000:8.2f} ms   p99 {percentile(latencies, 0.99) * 1000:8.2f} ms")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Expense Tracker HTTP API")
+    parser.add_argument("--url", help="server to test (default: start one on scratch databases)")
+    parser.add_argument("--clients", type=int, default=CLIENTS,
+                        help="concurrent client connections (at most the server's workers)")
+    parser.add_argument("--seconds", type=float, default=SECONDS)
+    parser.add_argument("--rows", type=int, default=SEED_ROWS, help="expenses loaded before the mixed load")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="expenses per /batch request")
+    parser.add_argument("--workers", type=int, default=server.WORKERS, help="worker threads of the scratch server")
+    args = parser.parse_args()
+
+    if args.url:
+        wait_for(args.url)
+        return 1 if run(args.url, args.clients, args.seconds, args.rows, args.batch_size) else 0
+
+    with tempfile.TemporaryDirectory(prefix="expense-loadtest-") as directory:
+        port = free_port()
+        # the server runs in its own process, so it doesn't share the clients' interpreter lock
+        process = multiprocessing.get_context("spawn").Process(target=_serve_scratch,
+                                                               args=(directory, port, args.workers), daemon=True)
+        process.start()
+        try:
+            url = f"http://127.0.0.1:{port}"
+            wait_for(url)
+            return 1 if run(url, args.clients, args.seconds, args.rows, args.batch_size) else 0
+        finally:
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,24 +1,28 @@
+import time
+
+# when the app started loading (for the startup report)
+STARTED = time.perf_counter()
+
 # basic Tkinter modules for GUI creation
 from tkinter import ttk
-from tkcalendar import *
 from functools import partial
+from bisect import bisect_left
 
-# data visualization modules
-import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib import style
+# plotting (matplotlib, NumPy) and the calendar widget are imported when first needed, to keep startup fast
 
 # miscellaneous modules
 from title_page import *
+import analytics
+from importer import import_expenses
+from exporter import export_expenses, export_budgets
+from snapshot import write_snapshot
+from tasks import TaskRunner
+from charts import ChartWindow, set_bars
 from datetime import datetime
 from tkinter import filedialog
-from PIL import ImageTk
-import csv
 import os
-
-matplotlib.use('TkAgg')
-style.use("ggplot")
+import sqlite3
+import sys
 
 
 # SET COLOUR CONSTANTS
@@ -27,6 +31,50 @@ HOVER_COLOUR = "#CDB7F6"
 DARK_PINK = "#e75480"
 PURPLE = "#CDB7F6"
 
+# file types offered when exporting a table (.gz files are compressed)
+EXPORT_FILETYPES = (("CSV File", "*.csv"), ("Text File", ".txt"), ("TSV File", "*.tsv"),
+                    ("Compressed CSV", "*.csv.gz"))
+# expenses can also be saved as a columnar snapshot (compact, for analytics tools)
+EXPENSE_EXPORT_FILETYPES = EXPORT_FILETYPES + (("Expense Snapshot", "*.exsnap"),)
+
+# most pages of expenses kept in the table at once, pages further from the view are dropped and fetched
+# again if they are scrolled back to
+MAX_LOADED_PAGES = 3
+
+# spans the line graph can cover, as the number of months up to the end of the selected month/year
+# (None: just the selected month/year); the graph is binned by day, week or month to suit the span
+LINE_RANGES = {"Selected Period": None, "Last 3 Months": 3, "Last 6 Months": 6, "Last Year": 12,
+               "Last 3 Years": 36, "Last 5 Years": 60}
+
+
+# records how long each startup step takes, printed when the app is run with --startup-report
+class StartupReport:
+    def __init__(self, started):
+        self.enabled = "--startup-report" in sys.argv
+        self._last = started
+        self._steps = []
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self._steps.append((step, now - self._last))
+        self._last = now
+
+    # leave out time spent waiting for the user (on the login screen)
+    def skip(self):
+        self._last = time.perf_counter()
+
+    def print(self):
+        if not self.enabled:
+            return
+        print("startup:")
+        for step, seconds in self._steps:
+            print(f"  {step:<24} {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<24} {sum(seconds for step, seconds in self._steps) * 1000:8.1f} ms")
+        self._steps.clear()
+
+
+startup = StartupReport(STARTED)
+
 
 # function to change properties of button on hover
 def change_on_hover(button):
@@ -38,17 +86,30 @@ def change_on_hover(button):
         background=BG_COLOUR, foreground="white"))
 
 
+# popup for a change that couldn't be saved because the database stayed locked (e.g. by an import or another
+# copy of the app) for longer than the backend retries
+def show_busy_error(error):
+    messagebox.showerror("Oops!", f"The database is busy, please try again in a moment\n({error})")
+
+
+# popup warning if the Dashboard's latest figures have a category over its budget
+def warn_if_over_budget(parent, category):
+    if analytics.exceeded_budgets(parent.home_screen.expense_sum_dict, category):
+        messagebox.showwarning("Alert!", "You have exceeded your monthly budget in that category")
+
+
 # Main screen class (tabs will be created on top of this layout)
 class Main(Tk):
-    def __init__(self):
+    def __init__(self, login_screen):
         super().__init__()
+        self._login_screen = login_screen
 
         # app width and height
         APP_WIDTH = 813
         APP_HEIGHT = 650
 
         # set window features
-        self.geometry(f'{APP_WIDTH}x{APP_HEIGHT}+{startup_screen.win_x_coord}+{startup_screen.win_y_coord}')
+        self.geometry(f'{APP_WIDTH}x{APP_HEIGHT}+{login_screen.win_x_coord}+{login_screen.win_y_coord}')
 
         # set window title
         self.title("Expense Tracker")
@@ -58,9 +119,9 @@ class Main(Tk):
                            activeBackground=HOVER_COLOUR, activeForeground='white',
                            disabledbackground="white", disabledforeground="black")
 
-        # SET IMAGE CONSTANTS
-        self.REFRESH_IMAGE = ImageTk.PhotoImage(file="refresh.png")
-        self.CHART_IMAGE = ImageTk.PhotoImage(file="chart.png")
+        # SET IMAGE CONSTANTS (Tk reads PNG files itself)
+        self.REFRESH_IMAGE = PhotoImage(file="refresh.png")
+        self.CHART_IMAGE = PhotoImage(file="chart.png")
 
         # SET FONT CONSTANTS
         self.BOLD_FONT = Font(family="Calibri", size=20, weight="bold")
@@ -69,10 +130,11 @@ class Main(Tk):
         # make username accessible to other classes
         self.username = self.get_username()
 
-        # connect/create table of categories from database
-        START_CATEGORIES = ["Investments", "Education", "Entertainment", "Fees & Charges", "Personal Care", "Taxes",
-                            "Travel", "Food & Dining", "Home", "Kids", "Shopping", "Bills & Utilities"]
+        # worker threads for database queries, imports and exports (results come back through the event loop)
+        self.tasks = TaskRunner(self)
+        self.protocol("WM_DELETE_WINDOW", self.close)
 
+        # connect/create table of categories from database
         if len(query_categories(self.username)) == 0:
             for category in START_CATEGORIES:
                 insert_category(self.username, category)
@@ -90,32 +152,50 @@ class Main(Tk):
         ttk_style.map("TNotebook.Tab", background=[("selected", PURPLE)])
 
         # Create Notebook (from the ttk module) to add tabs onto
-        notebook = ttk.Notebook(self)
+        self.notebook = ttk.Notebook(self)
 
         # Tab1 - Home
         self.home_screen = HomeTab(self)
-        notebook.add(self.home_screen, text='Dashboard')
-
-        # Tab2 - Expenses
-        self.expense_screen = ExpenseTab(self)
-        notebook.add(self.expense_screen, text='Expenses')
-
-        # Tab3 - Budgets
-        self.budget_screen = BudgetTab(self)
-        notebook.add(self.budget_screen, text='Budgets')
-
-        # Tab4 - Stats
-        self.stats_screen = StatsTab(self)
-        notebook.add(self.stats_screen, text='Stats')
+        self.notebook.add(self.home_screen, text='Dashboard')
+
+        # Tab2 - Expenses, Tab3 - Budgets, Tab4 - Stats
+        # these are built the first time they are selected (None until then), in an empty frame added now
+        self.expense_screen = self.budget_screen = self.stats_screen = None
+        self._unbuilt_tabs = {}
+        for attribute, tab_class, text in (("expense_screen", ExpenseTab, 'Expenses'),
+                                           ("budget_screen", BudgetTab, 'Budgets'),
+                                           ("stats_screen", StatsTab, 'Stats')):
+            placeholder = Frame(self)
+            self.notebook.add(placeholder, text=text)
+            self._unbuilt_tabs[str(placeholder)] = (placeholder, attribute, tab_class, text)
+        self.notebook.bind("<<NotebookTabChanged>>", self._build_selected_tab)
 
         # expanding tabs to their size
-        notebook.pack(expand=1, fill="both")
+        self.notebook.pack(expand=1, fill="both")
         self.resizable(width=False, height=False)
 
+    # build a tab the first time it is selected, filling its empty frame
+    def _build_selected_tab(self, event):
+        unbuilt = self._unbuilt_tabs.pop(self.notebook.select(), None)
+        if unbuilt is None:
+            return
+        placeholder, attribute, tab_class, text = unbuilt
+        startup.skip()
+        tab = tab_class(self)
+        tab.pack(in_=placeholder, expand=1, fill="both")
+        setattr(self, attribute, tab)
+        startup.mark(f"{text} tab")
+        startup.print()
+
+    # stop the background workers before closing the window
+    def close(self):
+        self.tasks.shutdown()
+        self.destroy()
+
     # getter method to access private username variable throughout file
     def get_username(self):
         # set username
-        self._username = startup_screen.login_username.get()
+        self._username = self._login_screen.login_username.get()
         return self._username
 
 
@@ -133,35 +213,6 @@ class HomeTab(Frame):
         label = Label(self, text=f"Welcome back {parent.username}!", font=parent.BOLD_FONT)
         label.pack(side=TOP, padx=74, pady=(30, 0), anchor=NW)
 
-        # set and format current month/year
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        current_year_name = datetime.strptime(str(current_year), '%Y')
-        current_year_name = current_year_name.strftime("%Y")
-        current_month_name = datetime.strptime(str(current_month), "%m")
-        current_month_name = current_month_name.strftime("%B")
-
-        # set lists to determine savings
-        budgets = query_budgets(parent.username)
-        expenses = fetch_expenses_from(parent.username, current_month_name, current_year_name)
-        self._savings = []
-
-        # algorithm to create a list of tuples that shows monthly savings in relation to budget
-        for budget in budgets:
-            budget_category = budget[1]
-            budget_amt = float(budget[2])
-            for expense in expenses:
-                expense_category = expense[3]
-                if budget_category == expense_category:
-                    expense_amt = float(expense[2])
-                    self._savings.append((budget_category, budget_amt - expense_amt))
-
-        for budget in budgets:
-            budget_category = budget[1]
-            budget_amt = float(budget[2])
-            if budget_category not in [saving[0] for saving in self._savings]:
-                self._savings.append((budget_category, budget_amt))
-
         # Button to display categories
         display_cat_btn = Button(self, text="Display Categories", width=25, height=2,
                                  font=Font(family="Fixedsys", size=14, weight="bold"),
@@ -189,7 +240,15 @@ class HomeTab(Frame):
         bottom_savings_btn.pack(padx=74, pady=10, anchor=NW)
         change_on_hover(bottom_savings_btn)
 
-        # display savings table for current month
+        # savings chart windows, created the first time each one is shown
+        self._charts = {}
+
+        # display savings table for current month (also sets the monthly savings used by the charts),
+        # empty until the first refresh has finished in the background
+        self.tasks = parent.tasks
+        self._budget_report = []
+        self.expense_sum_dict = {}
+        self._create_savings_table()
         self.display_savings_table(parent.username)
 
     def _display_categories(self, parent):
@@ -227,11 +286,17 @@ class HomeTab(Frame):
     # add category
     def _add_category(self, parent):
         if self.new_category.get().strip() and self.new_category.get().replace(" ", "").isalpha():
-            insert_category(parent.username, self.new_category.get())
+            try:
+                insert_category(parent.username, self.new_category.get())
+            except sqlite3.OperationalError as error:
+                show_busy_error(error)
         else:
             messagebox.showerror("Oops!", "Please enter a valid category\n(no digits/symbols)")
-        ExpenseTab.update_categories(parent.expense_screen, parent)
-        BudgetTab.update_categories(parent.budget_screen, parent)
+        # tabs that haven't been built yet will read the categories when they are
+        if parent.expense_screen is not None:
+            ExpenseTab.update_categories(parent.expense_screen, parent)
+        if parent.budget_screen is not None:
+            BudgetTab.update_categories(parent.budget_screen, parent)
         self.add_cat_window.destroy()
         if hasattr(self, "display_cat_window"):
             self.display_cat_window.destroy()
@@ -254,106 +319,79 @@ class HomeTab(Frame):
     def _delete_category(self, parent):
         cat_to_delete = self.category_list.get(ANCHOR)
         self.display_cat_window.destroy()
-        delete_category(parent.username, cat_to_delete)
-        ExpenseTab.update_categories(parent.expense_screen, parent)
-        BudgetTab.update_categories(parent.budget_screen, parent)
+        try:
+            delete_category(parent.username, cat_to_delete)
+        except sqlite3.OperationalError as error:
+            show_busy_error(error)
+        # tabs that haven't been built yet will read the categories when they are
+        if parent.expense_screen is not None:
+            ExpenseTab.update_categories(parent.expense_screen, parent)
+        if parent.budget_screen is not None:
+            BudgetTab.update_categories(parent.budget_screen, parent)
         self._display_categories(parent)
 
     def top_monthly_savings(self):
-        if len(self._savings) == 0:
+        if len(self._budget_report) == 0:
             messagebox.showerror("Alert!", "Please add more information")
         else:
-            self._savings.sort(key=lambda x: x[1])
-            self._savings.reverse()
-            savings = self._savings[:5]
-
-            amt_savings = [saving[1] for saving in savings]
-            cat_savings = [saving[0] for saving in savings]
-
-            # hide every other x tick
-            plt.figure(figsize=(5, 3), dpi=100)
-            plt.barh(cat_savings, amt_savings, color=PURPLE)
-
-            # hide every other x tick
-            ax = plt.gca()
-            temp = ax.xaxis.get_ticklabels()
-            print(set(temp))
-            print(set(temp[::2]))
-            temp = list(set(temp) - set(temp[1::2]))
-
-            for tick in temp:
-                tick.set_visible(False)
-
-            plt.title('Top Monthly Savings ($)')
-            plt.subplots_adjust(left=0.27, right=0.86, bottom=0.15, top=0.88)
-            plt.show()
+            self._show_savings_chart("top", 'Top Monthly Savings ($)',
+                                     analytics.ranked_savings(self._budget_report, top=True), PURPLE)
 
     def bottom_monthly_savings(self):
-        if len(self._savings) == 0:
+        if len(self._budget_report) == 0:
             messagebox.showerror("Alert!", "Please add more information")
         else:
-            self._savings.sort(key=lambda x: x[1])
-            self._savings = self._savings[:5]
-
-            amt_savings = [saving[1] for saving in self._savings]
-            cat_savings = [saving[0] for saving in self._savings]
-
-            plt.figure(figsize=(5, 3), dpi=100)
-            plt.barh(cat_savings, amt_savings, color=DARK_PINK)
-
-            # hide every other x tick
-            ax = plt.gca()
-            temp = ax.xaxis.get_ticklabels()
-            temp = list(set(temp) - set(temp[1::2]))
-            for tick in temp:
-                tick.set_visible(False)
-
-            plt.title('Bottom Monthly Savings ($)')
-            plt.xlabel('$')
-            plt.subplots_adjust(left=0.27, right=0.86, bottom=0.15, top=0.88)
-            plt.show()
-
-    def display_savings_table(self, user):
-        # set and format current month/year
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        current_year_name = datetime.strptime(str(current_year), '%Y')
-        current_year_name = current_year_name.strftime("%Y")
-        current_month_name = datetime.strptime(str(current_month), "%m")
-        current_month_name = current_month_name.strftime("%B")
-
-        # set lists to create chart
-        expenses = fetch_expenses_from(user, current_month_name, current_year_name)
-        budgets = query_budgets(user)
-        budget_amounts = [budget[2] for budget in budgets]
-        budget_categories = [category[1] for category in budgets]
-        categories = [category for category in query_categories(user)]
-        categories = list(dict.fromkeys(categories))
-        expense_categories = {}
-
-        for category in categories:
-            expense_amount = [
-                float(expense[2]) for expense in expenses if expense[3] == category
-            ]
-            expense_categories[category] = sum(expense_amount)
-
-        # creates a dictionary in the form {category: budget}
-        budget_dict = {budget_categories[i]: budget_amounts[i] for i in range(len(budget_categories))}
-        category_budget_dict = {}
-        for budget_category in budget_dict:
-            for category in categories:
-                if category == budget_category:
-                    category_budget_dict[category] = float(budget_dict[budget_category])
-                else:
-                    continue
-
-        # creates a dictionary that associates categories with their respective budgets, total expenses, and savings
-        self.expense_sum_dict = {
-            cat: (category_budget_dict[cat], expense_categories[cat],
-                  category_budget_dict[cat] - expense_categories[cat])
-            for cat in category_budget_dict
-        }
-
+            self._show_savings_chart("bottom", 'Bottom Monthly Savings ($)',
+                                     analytics.ranked_savings(self._budget_report, top=False), DARK_PINK, xlabel='$')
+
+    # draw savings as horizontal bars in a chart window that is reused between clicks
+    def _show_savings_chart(self, kind, title, savings, colour, xlabel=None):
+        if kind not in self._charts:
+            self._charts[kind] = ChartWindow(self, title, figsize=(5, 3))
+        chart = self._charts[kind]
+
+        # first use: set up the parts of the chart that never change
+        if not chart.artists:
+            from matplotlib.ticker import MaxNLocator
+
+            # show every other x tick at most
+            chart.axes.xaxis.set_major_locator(MaxNLocator(4))
+            chart.axes.set_title(title)
+            if xlabel:
+                chart.axes.set_xlabel(xlabel)
+            chart.figure.subplots_adjust(left=0.27, right=0.86, bottom=0.15, top=0.88)
+
+        amt_savings = [saving[1] for saving in savings]
+        cat_savings = [saving[0] for saving in savings]
+        positions = range(len(savings))
+
+        chart.artists["bars"] = set_bars(chart.axes, chart.artists.get("bars"), positions, amt_savings,
+                                         horizontal=True, color=colour)
+        chart.axes.set_yticks(positions, cat_savings)
+        chart.rescale()
+        chart.show()
+
+    # refresh the savings table in the background (so a long import holding the database doesn't freeze the
+    # window); then() runs once the table shows the new figures
+    def display_savings_table(self, user, then=None):
+        self.tasks.submit("savings", self._query_savings, user, on_done=partial(self._savings_loaded, then))
+
+    @staticmethod
+    def _query_savings(user):
+        # budgets, money spent and savings (in cents) for the current month, used by the savings charts
+        budget_report = analytics.budget_report(user, *analytics.current_month())
+
+        # the same for the categories that still exist, shown in the table and used for notifications
+        return budget_report, analytics.savings_table(budget_report, query_categories(user))
+
+    def _savings_loaded(self, then, result):
+        self._budget_report, self.expense_sum_dict = result
+        self.savings_table.delete(*self.savings_table.get_children())
+        self._fill_savings_table()
+        if then is not None:
+            then()
+
+    def _create_savings_table(self):
         # create a Treeview frame
         self.tree_frame = LabelFrame(self, text="Savings Table", font=Font(family="Calibri", size=15, weight="bold"))
         self.tree_frame.place(x=400, y=100)
@@ -387,20 +425,17 @@ class HomeTab(Frame):
         self.savings_table.heading("Spent", text="Spent ($)", anchor=CENTER)
         self.savings_table.heading("Savings", text="Savings ($)", anchor=CENTER)
 
+    def _fill_savings_table(self):
         for category, amounts in self.expense_sum_dict.items():
             self.savings_table.insert(parent='', index='end', text='',
-                                      values=(category, amounts[0], amounts[1], amounts[2]))
+                                      values=(category, format_cents(amounts[0]), format_cents(amounts[1]),
+                                              format_cents(amounts[2])))
 
     # create notifications that alert user when spending > budget
     def notify(self):
-        exceeded_budget_categories = []
-        for category, amounts in self.expense_sum_dict.items():
+        exceeded_budget_categories = analytics.exceeded_budgets(self.expense_sum_dict)
 
-            # check if savings are less than zero
-            if amounts[2] < 0:
-                exceeded_budget_categories.append(category)
-
-            # notify the user with a popup if they have exceeded any of their budgets
+        # notify the user with a popup if they have exceeded any of their budgets
         if exceeded_budget_categories:
             messagebox.showwarning("Alert!", "You have exceeded your monthly budget in the following categories: "
                                              f"\n{exceeded_budget_categories}")
@@ -414,9 +449,14 @@ class ExpenseTab(Frame):
         super().__init__(parent)
 
         # create export button
-        export_button = Button(self, text="Export Table", command=self.export_data)
-        export_button.pack(padx=5, pady=(5, 0), anchor=NE)
-        change_on_hover(export_button)
+        self.export_button = Button(self, text="Export Table", command=partial(self.export_data, parent))
+        self.export_button.pack(padx=5, pady=(5, 0), anchor=NE)
+        change_on_hover(self.export_button)
+
+        # create import button
+        import_button = Button(self, text="Import Data", command=partial(self.import_data, parent))
+        import_button.place(relx=1.0, x=-100, y=5, anchor=NE)
+        change_on_hover(import_button)
 
         # Create table label
         table_label = Label(self, text=f"{parent.username}'s Expense Catalog", font=parent.BOLD_FONT)
@@ -430,8 +470,12 @@ class ExpenseTab(Frame):
         self.tree_scroll = Scrollbar(self.tree_frame)
         self.tree_scroll.pack(side=RIGHT, fill=Y)
 
+        # paging state for the table (set by reload_table)
+        self._has_more = False
+        self._loading = False
+
         # create the Treeview table
-        self.expense_table = ttk.Treeview(self.tree_frame, yscrollcommand=self.tree_scroll.set, selectmode="extended",
+        self.expense_table = ttk.Treeview(self.tree_frame, yscrollcommand=self._on_scroll, selectmode="extended",
                                           height=14)
         self.expense_table.pack()
 
@@ -461,9 +505,6 @@ class ExpenseTab(Frame):
         self.expense_table.tag_configure('evenrow', background="white")
         self.expense_table.tag_configure('oddrow', background=PURPLE)
 
-        # Finally, display our table to the screen
-        self.display_table(records=query_expense(parent.username))
-
         # Add record entry boxes
         data_frame = LabelFrame(self, text="Record")
         data_frame.pack(fill="x", expand=True, padx=74)
@@ -490,6 +531,7 @@ class ExpenseTab(Frame):
 
         self.date_label = Label(data_frame, text="Date")
         self.date_label.grid(row=1, column=2, padx=10, pady=10)
+        from tkcalendar import DateEntry
         self.date_entry = DateEntry(data_frame, width=18)
         self.date_entry.grid(row=1, column=3, padx=10, pady=10)
 
@@ -526,29 +568,164 @@ class ExpenseTab(Frame):
                command=partial(self.sort_expense, parent)) \
             .place(x=710, y=75)
 
+        # Finally, display our table to the screen (the first page, more rows load as the table is scrolled)
+        self.username = parent.username
+        self.tasks = parent.tasks
+        self.reload_table()
+
     def update_categories(self, parent):
         self.category_entry['values'] = query_categories(parent.username)
 
     def sort_expense(self, parent):
         # refresh treeview table and list according to selected sort method (by id, date, expense amount, or category)
+        self.reload_table()
+
+    # clear the treeview table and load its first page
+    def reload_table(self):
         self.expense_table.delete(*self.expense_table.get_children())
-        self.display_table(records=sort_by(parent.username, self.sort_method.get()))
+        # later pages must follow the order the first one was loaded in
+        self._page_sort = self.sort_method.get()
+        # sort keys of the loaded rows, in table order (the last element of each key is the record id)
+        self._keys = []
+        # the loaded rows are a window onto the table: keys of its first and last rows as fetched, and
+        # whether there are rows before and after it still in the database
+        self._first_key = None
+        self._last_key = None
+        self._has_before = False
+        self._has_more = True
+        self.load_page()
+
+    # fetch the next page of records (in the selected sort order) in the background
+    # (this replaces a page that is still loading, e.g. one for the previous sort order)
+    def load_page(self):
+        if not self._has_more:
+            return
+        self._loading = True
+        self._loading_before = False
+        self.tasks.submit("expense-page", fetch_expense_page, self.username, self._page_sort, self._last_key,
+                          on_done=self._page_loaded)
+
+    # fetch the page before the first loaded row (one dropped from the table earlier) in the background
+    def load_previous_page(self):
+        if not self._has_before:
+            return
+        self._loading = True
+        self._loading_before = True
+        self.tasks.submit("expense-page", fetch_expense_page, self.username, self._page_sort, self._first_key,
+                          PAGE_SIZE, "desc", on_done=self._previous_page_loaded)
+
+    # add a fetched page to the bottom of the treeview table, dropping pages off the top past the limit
+    def _page_loaded(self, records):
+        self._loading = False
+        self._has_more = len(records) == PAGE_SIZE
+        if not records:
+            return
+        self._last_key = page_key(self._page_sort, records[-1])
+        if not self._keys:
+            self._first_key = page_key(self._page_sort, records[0])
+        self.display_table(records)
+        excess = len(self._keys) - MAX_LOADED_PAGES * PAGE_SIZE
+        if excess > 0:
+            self._drop_rows(0, excess)
+            self._first_key = self._keys[0]
+            self._has_before = True
+
+    # add a fetched page (read backwards from the first loaded row) to the top of the treeview table, dropping pages off the bottom
+    # past the limit
+    def _previous_page_loaded(self, records):
+        self._loading = False
+        self._has_before = len(records) == PAGE_SIZE
+        if not records:
+            return
+        records.reverse()
+        self._first_key = page_key(self._page_sort, records[0])
+        for index, record in enumerate(records):
+            self._keys.insert(index, page_key(self._page_sort, record))
+            self._insert_row(index, record)
+        excess = len(self._keys) - MAX_LOADED_PAGES * PAGE_SIZE
+        if excess > 0:
+            self._drop_rows(len(self._keys) - excess, len(self._keys))
+            self._last_key = self._keys[-1]
+            self._has_more = True
+        # keep the rows that were in view where they were (the view is counted in rows from the top)
+        self.expense_table.yview_scroll(len(records), "units")
+
+    # take the loaded rows in [start, stop) out of the table, keeping the rows in view where they were
+    def _drop_rows(self, start, stop):
+        self.expense_table.delete(*(key[-1] for key in self._keys[start:stop]))
+        del self._keys[start:stop]
+        if start == 0:
+            self.expense_table.yview_scroll(-stop, "units")
+
+    # scrollbar callback, loads another page once the view gets close to either end of the loaded rows
+    def _on_scroll(self, first, last):
+        self.tree_scroll.set(first, last)
+        self._restripe()
+        if self._loading:
+            return
+        if self._has_more and float(last) > 0.9:
+            self.load_page()
+        elif self._has_before and float(first) < 0.1:
+            self.load_previous_page()
 
     # add our data to the treeview table
     def display_table(self, records):
-        for count, record in enumerate(records):
-            if count % 2 == 0:
-                self.expense_table.insert(parent='', index='end', iid=count, text='',
-                                          values=(
-                                              record[1], format(float(record[2]), '.2f'), record[3], record[4],
-                                              record[5]),
-                                          tags=('evenrow',))
+        for record in records:
+            self._keys.append(page_key(self._page_sort, record))
+            self._insert_row(len(self._keys) - 1, record)
+
+    # insert a record at a position in the table (rows are identified by their database id)
+    def _insert_row(self, index, record):
+        if index % 2 == 0:
+            self.expense_table.insert(parent='', index=index, iid=record[5], text='',
+                                      values=(
+                                          record[1], format_cents(record[2]), record[3], format_day(record[4]),
+                                          record[5]),
+                                      tags=('evenrow',))
+        else:
+            self.expense_table.insert(parent='', index=index, iid=record[5], text='',
+                                      values=(
+                                          record[1], format_cents(record[2]), record[3], format_day(record[4]),
+                                          record[5]),
+                                      tags=('oddrow',))
+
+    # re-apply the striped row tags to the rows in view (rows further down get theirs when they are scrolled
+    # to, so inserting or deleting a row doesn't re-tag every loaded row after it)
+    def _restripe(self):
+        first, last = self.expense_table.yview()
+        count = len(self._keys)
+        for index in range(int(first * count), min(count, int(last * count) + 1)):
+            self.expense_table.item(self._keys[index][-1], tags=('evenrow' if index % 2 == 0 else 'oddrow',))
+
+    # fetch the page that is loading again, as it may have been read before a write
+    def _reload_pending_page(self):
+        if self._loading:
+            if self._loading_before:
+                self.load_previous_page()
             else:
-                self.expense_table.insert(parent='', index='end', iid=count, text='',
-                                          values=(
-                                              record[1], format(float(record[2]), '.2f'), record[3], record[4],
-                                              record[5]),
-                                          tags=('oddrow',))
+                self.load_page()
+
+    # show a new or changed record in its sorted position
+    def show_record(self, record):
+        self._reload_pending_page()
+        key = page_key(self._page_sort, record)
+        index = bisect_left(self._keys, key)
+        # rows that sort outside the loaded ones will come in with the page they belong to
+        if index == len(self._keys) and self._has_more or index == 0 and self._has_before:
+            return
+        self._keys.insert(index, key)
+        self._insert_row(index, record)
+        self._restripe()
+
+    # take a record out of the table (if it has been loaded)
+    def forget_record(self, oid):
+        self._reload_pending_page()
+        if not self.expense_table.exists(oid):
+            return
+        index = self.expense_table.index(oid)
+        self.expense_table.delete(oid)
+        del self._keys[index]
+        self._restripe()
 
     # clear entries under the treeview table
     def clear_entries(self):
@@ -588,17 +765,14 @@ class ExpenseTab(Frame):
 
             # add logic for message box
             if response == 1:  # if yes is clicked
-                for record in records:
-                    selected = int(record)
-                    item_to_delete = self.expense_table.item(selected, 'values')
-                    item_id = item_to_delete[4]
-
-                    # delete record from database
-                    delete_expense(item_id)
-
-                # refresh treeview table to show changes onscreen
-                self.expense_table.delete(*self.expense_table.get_children())
-                self.display_table(records=sort_by(parent.username, self.sort_method.get()))
+                try:
+                    for record in records:
+                        # delete record from database, then from the treeview table (each row's iid is its id)
+                        delete_expense(parent.username, int(record))
+                        self.forget_record(int(record))
+                except sqlite3.OperationalError as error:
+                    show_busy_error(error)
+                    return
 
                 # refresh savings table (in Dashboard)
                 parent.home_screen.display_savings_table(parent.username)
@@ -622,45 +796,33 @@ class ExpenseTab(Frame):
                 self.datetime_obj = datetime.strptime(self.date_entry.get(), '%m/%d/%y')
                 self.formatted_date = self.datetime_obj.strftime('%Y-%m-%d')
 
-                # loop through selected records and find the id of each one
+                # loop through selected records (each row's iid is the id of its record)
                 for record in records:
-                    selected = int(record)
-                    item_to_update = self.expense_table.item(selected, 'values')
-                    item_id = item_to_update[4]
-
                     # apply the update to the backend database using the id of the record
+                    item_id = int(record)
                     update_expense(parent.username, self.name_entry.get(), self.expense_amt,
                                    self.selected_category.get(),
                                    self.formatted_date, item_id)
 
-                # refresh treeview table to show changes onscreen
-                self.expense_table.delete(*self.expense_table.get_children())
-                self.display_table(records=sort_by(parent.username, self.sort_method.get()))
+                    # move the row to its new position in the treeview table
+                    self.forget_record(item_id)
+                    self.show_record((parent.username, self.name_entry.get(), to_cents(self.expense_amt),
+                                      self.selected_category.get(), to_day(self.formatted_date), item_id))
 
-                # refresh savings table (in Dashboard)
-                parent.home_screen.display_savings_table(parent.username)
+                # refresh savings table (in Dashboard), then notify the user if they have exceeded any budgets
+                parent.home_screen.display_savings_table(
+                    parent.username, then=partial(warn_if_over_budget, parent, self.selected_category.get()))
 
                 # pop-up indicating success
                 messagebox.showinfo("Success!", "Item(s) successfully updated")
 
-                # notify the user if they have exceeded any budgets
-                exceeded_budget_categories = []
-                for category, amounts in parent.home_screen.expense_sum_dict.items():
-
-                    # check if savings are less than zero
-                    if amounts[2] < 0 and category == self.selected_category.get():
-                        exceeded_budget_categories.append(category)
-
-                # notify the user with a popup if they have exceeded any of their budgets
-                if exceeded_budget_categories:
-                    messagebox.showwarning("Alert!",
-                                           "You have exceeded your monthly budget in that category")
-
                 # clear entries
                 self.clear_entries()
 
             except ValueError:  # the inputted expense cannot be converted to a float
                 messagebox.showerror("Oops!", "Please enter a valid amount!")
+            except sqlite3.OperationalError as error:
+                show_busy_error(error)
         else:  # all the entries have not been filled before updating record
             messagebox.showerror("Oops!", "Please fill in all the fields")
 
@@ -678,40 +840,30 @@ class ExpenseTab(Frame):
                 self.formatted_date = self.datetime_obj.strftime('%Y-%m-%d')
 
                 # insert expense into database
-                insert_expense(parent.username, self.name_entry.get(), self.expense_amt, self.selected_category.get(),
-                               self.formatted_date)
+                record = (parent.username, self.name_entry.get(), self.expense_amt, self.selected_category.get(),
+                          self.formatted_date)
+                item_id = insert_expense(*record)
                 self.clear_entries()
 
-                # refresh treeview table to show changes onscreen
-                self.expense_table.delete(*self.expense_table.get_children())
-                self.display_table(records=sort_by(parent.username, self.sort_method.get()))
+                # add the new row to the treeview table (the database stores cents and day numbers)
+                self.show_record((record[0], record[1], to_cents(record[2]), record[3], to_day(record[4]), item_id))
 
-                # refresh savings table (in Dashboard)
-                parent.home_screen.display_savings_table(parent.username)
+                # refresh savings table (in Dashboard), then notify the user if they have exceeded any budgets
+                parent.home_screen.display_savings_table(parent.username,
+                                                         then=partial(warn_if_over_budget, parent, record[3]))
 
                 # pop-up indicating success
                 messagebox.showinfo("Success!", "Item successfully added")
 
-                # notify the user if they have exceeded any budgets
-                exceeded_budget_categories = []
-                for category, amounts in parent.home_screen.expense_sum_dict.items():
-
-                    # check if savings are less than zero
-                    if amounts[2] < 0 and category == self.selected_category.get():
-                        exceeded_budget_categories.append(category)
-
-                # popup warning
-                if exceeded_budget_categories:
-                    messagebox.showwarning("Alert!",
-                                           "You have exceeded your monthly budget in that category")
-
             except ValueError:  # the inputted expense cannot be converted to a float
                 messagebox.showerror("Oops!", "Please enter a valid amount!")
+            except sqlite3.OperationalError as error:
+                show_busy_error(error)
         else:  # all the entries have not been filled before updating record
             messagebox.showerror("Oops!", "Please fill in all the fields")
 
     # export table data (.csv file for excel, no file ending for text file)
-    def export_data(self):
+    def export_data(self, parent):
         # error check table length before exporting
         if len(self.expense_table.get_children()) < 1:
             messagebox.showinfo("Alert!", "No data available to export")
@@ -719,30 +871,73 @@ class ExpenseTab(Frame):
 
         # asks user to save file as a specified name
         file = filedialog.asksaveasfilename(initialdir=os.getcwd(), title="Save Table",
-                                            filetype=(("CSV File", "*.csv"), ("Text File", ".txt")),
-                                            defaultextension=".txt")
+                                            filetype=EXPENSE_EXPORT_FILETYPES, defaultextension=".txt")
 
-        # ensures an error doesn't pop up if the user exits the export popup
-        try:
-            with open(file, mode='w', newline='') as myfile:
-                exp_writer = csv.writer(myfile, delimiter=',')
-                exp_writer.writerow(["Name", "Amount", "Category", "Date", "ID"])
-                for i in self.expense_table.get_children():
-                    row = self.expense_table.item(i)['values']
-                    exp_writer.writerow(row)
+        # the user exited the export popup
+        if not file:
+            return
+
+        # stream the records from the database into the file in the background
+        # (the table only holds the pages loaded so far), showing progress on the export button
+        progress = partial(self.tasks.post, self._export_progress)
+        if file.lower().endswith(".exsnap"):
+            export = partial(write_snapshot, parent.username, file, progress=progress)
+        else:
+            export = partial(export_expenses, parent.username, file, sort_method=self._page_sort, progress=progress)
+        self.tasks.submit("export", export,
+                          on_done=self._export_done,
+                          on_error=lambda error: self._export_done(error=error))
+
+    def _export_progress(self, count):
+        self.export_button.config(text=f"Exported {count:,}")
+
+    def _export_done(self, count=None, error=None):
+        self.export_button.config(text="Export Table")
+        if error is None:
             messagebox.showinfo("Success!", "File successfully exported")
+        else:
+            messagebox.showerror("Oops!", f"Could not export file:\n{error}")
 
-        except FileNotFoundError:
-            pass
+    # import expenses from a .csv/.txt table or an .ofx/.qfx bank statement
+    def import_data(self, parent):
+        file = filedialog.askopenfilename(initialdir=os.getcwd(), title="Import Expenses",
+                                          filetype=(("CSV File", "*.csv"), ("Text File", "*.txt"),
+                                                    ("TSV File", "*.tsv"), ("Compressed CSV", "*.csv.gz *.tsv.gz"),
+                                                    ("Bank Statement", "*.ofx *.qfx")))
+        # the user closed the dialog
+        if not file:
+            return
+
+        # rows without a category go into the selected (or first) category
+        categories = query_categories(parent.username)
+        default_category = self.selected_category.get() or (categories[0] if categories else "Uncategorized")
+
+        # read the file in the background
+        self.tasks.submit("import", import_expenses, parent.username, file, default_category,
+                          on_done=partial(self._import_done, parent),
+                          on_error=lambda error: messagebox.showerror("Oops!", f"Could not import file:\n{error}"))
+
+    def _import_done(self, parent, result):
+        count, rate = result
+
+        # refresh treeview table to show changes onscreen
+        self.reload_table()
+
+        # refresh savings table (in Dashboard)
+        parent.home_screen.display_savings_table(parent.username)
+
+        # pop-up indicating success
+        messagebox.showinfo("Success!", f"{count} record(s) imported ({rate:,.0f} rows/s)")
 
 
 # Budget Tab
 class BudgetTab(Frame):
     def __init__(self, parent):
         super().__init__(parent)
+        self.tasks = parent.tasks
 
         # create export button
-        export_button = Button(self, text="Export Table", command=self.export_data)
+        export_button = Button(self, text="Export Table", command=partial(self.export_data, parent))
         export_button.pack(padx=5, pady=(5, 0), anchor=NE)
         change_on_hover(export_button)
 
@@ -831,16 +1026,22 @@ class BudgetTab(Frame):
 
     # add our data to the screen
     def display_table(self, records):
-        for count, record in enumerate(records):
+        count = len(self.budget_table.get_children())
+        for count, record in enumerate(records, start=count):
             if count % 2 == 0:
-                self.budget_table.insert(parent='', index='end', iid=count, text='',
-                                         values=(record[1], format(float(record[2]), '.2f'), record[3]),
+                self.budget_table.insert(parent='', index='end', iid=record[3], text='',
+                                         values=(record[1], format_cents(record[2]), record[3]),
                                          tags=('evenrow',))
             else:
-                self.budget_table.insert(parent='', index='end', iid=count, text='',
-                                         values=(record[1], format(float(record[2]), '.2f'), record[3]),
+                self.budget_table.insert(parent='', index='end', iid=record[3], text='',
+                                         values=(record[1], format_cents(record[2]), record[3]),
                                          tags=('oddrow',))
 
+    # re-apply the striped row tags after rows have been removed
+    def _restripe(self):
+        for count, item in enumerate(self.budget_table.get_children()):
+            self.budget_table.item(item, tags=('evenrow' if count % 2 == 0 else 'oddrow',))
+
     def clear_entries(self):
         # clear entry boxes
         self.amt_entry.delete(0, END)
@@ -872,17 +1073,16 @@ class BudgetTab(Frame):
 
             # add logic for message box
             if response == 1:  # if yes is clicked
-                for record in records:
-                    selected = int(record)
-                    item_to_delete = self.budget_table.item(selected, 'values')
-                    item_id = item_to_delete[2]
-
-                    # delete record from database
-                    delete_budget(item_id)
-
-                # refresh treeview table to show changes onscreen
-                self.budget_table.delete(*self.budget_table.get_children())
-                self.display_table(records=query_budgets(parent.username))
+                try:
+                    for record in records:
+                        # delete record from database, then from the treeview table (each row's iid is its id)
+                        delete_budget(parent.username, int(record))
+                        self.budget_table.delete(record)
+                except sqlite3.OperationalError as error:
+                    show_busy_error(error)
+                    return
+                finally:
+                    self._restripe()
 
                 # refresh savings table (in Dashboard)
                 parent.home_screen.display_savings_table(parent.username)
@@ -909,40 +1109,27 @@ class BudgetTab(Frame):
                     self.budget_amt = float(self.amt_entry.get())
 
                     for record in records:
-                        selected = int(record)
-                        item_to_update = self.budget_table.item(selected, 'values')
-                        item_id = item_to_update[2]
-
                         # apply the update to the backend database
+                        item_id = int(record)
                         update_budget(parent.username, self.selected_category.get(), self.budget_amt, item_id)
 
-                    # refresh treeview table to show changes onscreen
-                    self.budget_table.delete(*self.budget_table.get_children())
-                    self.display_table(records=query_budgets(parent.username))
+                        # show the change in the treeview table
+                        self.budget_table.item(item_id, values=(self.selected_category.get(),
+                                                                format_cents(to_cents(self.budget_amt)), item_id))
 
-                    # refresh savings table (in Dashboard)
-                    parent.home_screen.display_savings_table(parent.username)
+                    # refresh savings table (in Dashboard), then notify the user if they have exceeded any budgets
+                    parent.home_screen.display_savings_table(
+                        parent.username, then=partial(warn_if_over_budget, parent, self.selected_category.get()))
 
                     # pop-up indicating success
                     messagebox.showinfo("Success!", "Item(s) successfully updated")
 
-                    # notify the user if they have exceeded any budgets
-                    exceeded_budget_categories = []
-                    for category, amounts in parent.home_screen.expense_sum_dict.items():
-
-                        # check if savings are less than zero
-                        if amounts[2] < 0 and category == self.selected_category.get():
-                            exceeded_budget_categories.append(category)
-
-                    # popup warning
-                    if exceeded_budget_categories:
-                        messagebox.showwarning("Alert!",
-                                               "You have exceeded your monthly budget in that category")
-
                     # clear entries
                     self.clear_entries()
                 except ValueError:  # the inputted expense cannot be converted to a float
                     messagebox.showerror("Oops!", "Please enter a valid amount!")
+                except sqlite3.OperationalError as error:
+                    show_busy_error(error)
             else:  # the category field has not been filled before updating record
                 messagebox.showerror("Oops!", "Please fill in the Category field")
 
@@ -963,39 +1150,29 @@ class BudgetTab(Frame):
                     self.budget_amt = float(self.amt_entry.get())
 
                     # insert budget into database
-                    insert_budget(parent.username, self.selected_category.get(), self.budget_amt)
+                    item_id = insert_budget(parent.username, self.selected_category.get(), self.budget_amt)
                     self.clear_entries()
 
-                    # refresh treeview table to show changes onscreen
-                    self.budget_table.delete(*self.budget_table.get_children())
-                    self.display_table(records=query_budgets(parent.username))
+                    # add the new row to the end of the treeview table
+                    self.display_table(records=[(parent.username, self.selected_category.get(),
+                                                 to_cents(self.budget_amt), item_id)])
 
-                    # refresh savings table (in Dashboard)
-                    parent.home_screen.display_savings_table(parent.username)
+                    # refresh savings table (in Dashboard), then notify the user if they have exceeded any budgets
+                    parent.home_screen.display_savings_table(
+                        parent.username, then=partial(warn_if_over_budget, parent, self.selected_category.get()))
 
                     # pop-up indicating success
                     messagebox.showinfo("Success!", "Item successfully added")
 
-                    # notify the user if they have exceeded any budgets
-                    exceeded_budget_categories = []
-                    for category, amounts in parent.home_screen.expense_sum_dict.items():
-
-                        # check if savings are less than zero
-                        if amounts[2] < 0 and category == self.selected_category.get():
-                            exceeded_budget_categories.append(category)
-
-                    # popup warning
-                    if exceeded_budget_categories:
-                        messagebox.showwarning("Alert!",
-                                               "You have exceeded your monthly budget in that category")
-
                 except ValueError:  # the inputted expense cannot be converted to a float
                     messagebox.showerror("Oops!", "Please enter a valid amount!")
+                except sqlite3.OperationalError as error:
+                    show_busy_error(error)
             else:  # the category field has not been filled before updating record
                 messagebox.showerror("Oops!", "Please fill in the Category field")
 
     # export table data (.csv file for excel, no file ending for text file)
-    def export_data(self):
+    def export_data(self, parent):
         # error check table length before exporting
         if len(self.budget_table.get_children()) < 1:
             messagebox.showinfo("Alert!", "No data available to export")
@@ -1003,27 +1180,25 @@ class BudgetTab(Frame):
 
         # asks user to save file as a specified name
         file = filedialog.asksaveasfilename(initialdir=os.getcwd(), title="Save Table",
-                                            filetype=(("CSV File", "*.csv"), ("Text File", ".txt")),
-                                            defaultextension=".txt")
+                                            filetype=EXPORT_FILETYPES, defaultextension=".txt")
 
-        # ensures an error doesn't pop up if the user exits the export popup
-        try:
-            with open(file, mode='w', newline='') as myfile:
-                exp_writer = csv.writer(myfile, delimiter=',')
-                exp_writer.writerow(["Category", "Amount", "ID"])
-                for i in self.budget_table.get_children():
-                    row = self.budget_table.item(i)['values']
-                    exp_writer.writerow(row)
-            messagebox.showinfo("Success!", "File successfully exported")
+        # the user exited the export popup
+        if not file:
+            return
 
-        except FileNotFoundError:
-            pass
+        # write the budgets from the database in the background
+        self.tasks.submit("budget-export", export_budgets, parent.username, file,
+                          on_done=lambda count: messagebox.showinfo("Success!", "File successfully exported"),
+                          on_error=lambda error: messagebox.showerror("Oops!", f"Could not export file:\n{error}"))
 
 
 # Stats Tab
 class StatsTab(Frame):
     def __init__(self, parent):
         super().__init__(parent)
+        self.tasks = parent.tasks
+        # chart windows, created the first time each chart is shown
+        self._charts = {}
         label = Label(self, text="Your Spending, Visualized", font=parent.BOLD_FONT)
         label.pack(padx=74, pady=(60, 0), anchor='nw')
 
@@ -1054,7 +1229,7 @@ class StatsTab(Frame):
         pie_btn.grid(row=1, column=4, padx=10)
 
         line_btn = Button(self.line_frame, text="Get Stats", command=partial(self.line_graph, parent.username))
-        line_btn.grid(row=1, column=4, padx=10)
+        line_btn.grid(row=1, column=6, padx=10)
 
         for button in (bar_btn, pie_btn, line_btn):
             change_on_hover(button)
@@ -1106,7 +1281,7 @@ class StatsTab(Frame):
 
         # labels and entries for line graphs
         self.line_month_entry = ttk.Combobox(self.line_frame, state="readonly", textvariable=self.selected_month_line,
-                                             values=months[:-1], width=12)
+                                             values=months, width=12)
         self.line_month_entry.set(months[0])
         self.line_month_entry.grid(row=1, column=1)
 
@@ -1115,139 +1290,174 @@ class StatsTab(Frame):
         self.line_year_entry.set(years[0])
         self.line_year_entry.grid(row=1, column=3)
 
+        Label(self.line_frame, text="Range").grid(row=1, column=4, padx=(10, 5))
+        self.line_range_entry = ttk.Combobox(self.line_frame, state="readonly", values=[*LINE_RANGES], width=14)
+        self.line_range_entry.set(next(iter(LINE_RANGES)))
+        self.line_range_entry.grid(row=1, column=5)
+
     # stats
     def bar_chart(self, user):
         # get user-chosen month
-        expenses = fetch_expenses_from(user, self.bar_month_entry.get(), self.bar_year_entry.get())
-        budgets = query_budgets(user)
-        budget_amounts = [budget[2] for budget in budgets]
-        budget_categories = [category[1] for category in budgets]
-        categories = [category[1] for category in budgets]
-        categories = list(dict.fromkeys(categories))
-        expense_categories = {}
-
-        for category in categories:
-            expense_amount = [
-                float(expense[2]) for expense in expenses if expense[3] == category
-            ]
-            expense_categories[category] = sum(expense_amount)
-
-        # creates a dictionary in the form {category: budget}
-        budget_dict = {budget_categories[i]: budget_amounts[i] for i in range(len(budget_categories))}
-        category_budget_dict = {}
-        for budget_category in budget_dict:
-            for category in categories:
-                if category == budget_category:
-                    category_budget_dict[category] = float(budget_dict[budget_category])
-                else:
-                    continue
+        month = self.bar_month_entry.get()
+        start, end = period_bounds(month, self.bar_year_entry.get())
+
+        # query in the background, a newer request for this chart replaces an unfinished one
+        self.tasks.submit("bar-chart", analytics.budget_report, user, start, end,
+                          on_done=partial(self._draw_bar_chart, month))
 
+    def _draw_bar_chart(self, month, report):
         # CREATE BUDGET VS. SPENT GRAPH
-        # creates a dictionary that associates categories with their respective expense sums and budgets
-        expense_sum_dict = {
-            cat: (category_budget_dict[cat], expense_categories[cat])
-            for cat in category_budget_dict
-        }
+        # creates a dictionary that associates categories with their respective budgets and expense sums (in dollars)
+        expense_sum_dict = {category: (from_cents(amounts[0]), from_cents(amounts[1]))
+                            for category, amounts in report.items()}
 
         # error checks for category length before creating chart
         if not expense_sum_dict:
             messagebox.showerror("Alert!", "This time period doesn't contain information")
         else:
-            # create chart figure
-            plt.figure(figsize=(6, 5), dpi=100)
+            chart = self._chart_window("bar", "Budget vs. Spent", figsize=(6, 5))
+            axes = chart.axes
 
-            # plot bars for the double-bar graph
+            # first use: add the features that stay the same between updates
+            if not chart.artists:
+                axes.set_xlabel("Categories", color='black')
+                axes.set_ylabel("Amount ($)", color='black')
+                axes.tick_params(axis='y', labelsize='small', labelcolor='black')
+                chart.figure.subplots_adjust(bottom=0.19)
+
+            import numpy as np
+
+            # update the bars for the double-bar graph
             values = np.arange(len(expense_sum_dict.keys()))  # generate x-axis values for graph
             WIDTH = 0.4
-            plt.bar(values, [budget[0] for budget in expense_sum_dict.values()],
-                    color=PURPLE, label='BUDGET', width=WIDTH)  # budget bar
-            plt.bar(values + WIDTH, [expense[1] for expense in expense_sum_dict.values()],
-                    color=DARK_PINK, label='SPENT', width=WIDTH)  # spent bar
-
-            # add features and display graph
-            plt.xlabel("Categories", color='black')
-            plt.ylabel("Amount ($)", color='black')
-            plt.xticks(values + (WIDTH / 2), expense_sum_dict.keys(), rotation=20,
-                       fontweight='light', fontsize='small', color='black')
-            plt.yticks(fontweight='light', fontsize='small', color='black')
-            plt.title(f"Budget vs. Spent, {self.bar_month_entry.get()}")
-            plt.legend()
-            plt.subplots_adjust(bottom=0.19)
-            plt.show()
+            chart.artists["budget"] = set_bars(axes, chart.artists.get("budget"), values,
+                                               [budget[0] for budget in expense_sum_dict.values()],
+                                               color=PURPLE, label='BUDGET', width=WIDTH)  # budget bar
+            chart.artists["spent"] = set_bars(axes, chart.artists.get("spent"), values + WIDTH,
+                                              [expense[1] for expense in expense_sum_dict.values()],
+                                              color=DARK_PINK, label='SPENT', width=WIDTH)  # spent bar
+
+            axes.set_xticks(values + (WIDTH / 2), expense_sum_dict.keys(), rotation=20,
+                            fontweight='light', fontsize='small', color='black')
+            axes.set_title(f"Budget vs. Spent, {month}")
+            axes.legend()
+            chart.rescale()
+            chart.show()
 
     # creation of pie chart
     def pie_chart(self, user):
-        expenses = fetch_expenses_from(user, self.pie_month_entry.get(), self.pie_year_entry.get())
-        categories = [category[3] for category in expenses]
-        categories = list(dict.fromkeys(categories))
-        expense_categories = {}
-        for category in categories:
-            expense_amount = [
-                float(expense[2]) for expense in expenses if expense[3] == category
-            ]
-            expense_categories[category] = sum(expense_amount)
+        month, year = self.pie_month_entry.get(), self.pie_year_entry.get()
+        start, end = period_bounds(month, year)
+
+        # query in the background, a newer request for this chart replaces an unfinished one
+        self.tasks.submit("pie-chart", analytics.spending_distribution, user, start, end,
+                          on_done=partial(self._draw_pie_chart, month, year))
+
+    def _draw_pie_chart(self, month, year, expense_categories):
+        # expense_categories is in the form {category : sum of expenses in that category}
 
         # error checks for category length before creating chart
         if not expense_categories:
             messagebox.showerror("Alert!", "This time period doesn't contain information")
         else:
             # CREATE EXPENSE DISTRIBUTION PIE CHART
-            # create a dictionary assigning in the form {category : sum of expenses in that category}
+            chart = self._chart_window("pie", "Expense Distribution", figsize=(7, 5))
+            axes = chart.axes
+
+            # first use: add the centre circle that turns the pie into a ring
+            if not chart.artists:
+                from matplotlib.patches import Circle
+
+                chart.artists["centre"] = axes.add_artist(Circle((0, 0), 0.70, fc='white'))
+                chart.figure.subplots_adjust(left=0.1, right=0.75)
+
+            # wedges depend on every value, so the previous ones (with their shadows and labels) are replaced
+            for artist in [*axes.patches, *axes.texts]:
+                if artist is not chart.artists["centre"]:
+                    artist.remove()
+
             explode_amt = 0.05
             explode = ((explode_amt,) * len(expense_categories))
-            plt.figure(figsize=(7, 5), dpi=100)
-
             COLOURS = [DARK_PINK, PURPLE, '#fd788b', '#feb1b7', '#ECD4FF', '#FFDCF4', '#B28DFF', '#FFAACC']
             # plot pieces for pie chart
-            plt.pie(expense_categories.values(),
-                    autopct='%1.0f%%', shadow=True, colors=COLOURS, pctdistance=0.85, explode=explode)
-            plt.legend(expense_categories.keys(),
-                       bbox_to_anchor=(1.0, 0.5, 0.4, 0.1), loc='center', facecolor='white', frameon=False)
-            plt.subplots_adjust(left=0.1, right=0.75)
-
-            centre_circle = plt.Circle((0, 0), 0.70, fc='white')
-            fig = plt.gcf()
-            fig.gca().add_artist(centre_circle)
+            wedges, texts, autotexts = axes.pie(expense_categories.values(), autopct='%1.0f%%', shadow=True,
+                                                colors=COLOURS, pctdistance=0.85, explode=explode)
+            # keep the centre circle on top of the new wedges
+            chart.artists["centre"].set_zorder(max(wedge.get_zorder() for wedge in wedges) + 1)
+
+            axes.legend(wedges, expense_categories.keys(),
+                        bbox_to_anchor=(1.0, 0.5, 0.4, 0.1), loc='center', facecolor='white', frameon=False)
             # add features and display chart
-            plt.title(f"Expense Distribution, {self.pie_month_entry.get()} {self.pie_year_entry.get()}")
-            plt.show()
+            axes.set_title(f"Expense Distribution, {month} {year}")
+            chart.show()
 
     # creation of line graph
     def line_graph(self, user):
-        expenses = fetch_expenses_from(user, self.line_month_entry.get(), self.line_year_entry.get())
-        expense_amts = [float(item[2]) for item in expenses]
-        # create list on the sum of expenses over time
-        for i in range(len(expense_amts)):
-            if i != 0:
-                expense_amts[i] += expense_amts[i - 1]
-
-        # create a list of the dates that correspond to these expenses
-        expense_dates = [int(item[4][8:10]) for item in expenses]
-
-        # create a dictionary of the two lists
-        expense_info = dict(zip(expense_dates, expense_amts))
-        expense_info[0] = 0
-        if len(expense_info) == 1:
+        month = self.line_month_entry.get()
+        start, end = period_bounds(month, self.line_year_entry.get())
+        months = LINE_RANGES[self.line_range_entry.get()]
+        if months is None:
+            title = month
+        else:
+            start, end = analytics.months_before(end, months)
+            title = f"{format_day(start)} to {format_day(end - 1)}"
+
+        # query and bin in the background, a newer request for this chart replaces an unfinished one
+        self.tasks.submit("line-graph", analytics.spending_over_time, user, start, end,
+                          on_done=lambda series: self._draw_line_graph(title, *series))
+
+    def _draw_line_graph(self, title, edges, cumulative):
+        if len(edges) == 0:
             messagebox.showerror("Alert!", "This time period doesn't contain information")
         else:
-            plt.figure(figsize=(6, 5), dpi=100)
-            plt.plot(sorted(expense_info.keys()), sorted(expense_info.values()), color=DARK_PINK)
-
-            # show x and y coords live
-            plt.gca().format_coord = lambda x, y: "Day: {:.0f}, Expense ($): {:.0f}".format(x, y)
-
-            # add features and display line graph
-            plt.ylabel("Amount Spent ($)", color='black')
-            plt.xlabel("Time", color='black')
-            # hide axes ticks
-            plt.gca().axes.xaxis.set_ticks([])
-            plt.gca().axes.yaxis.set_ticks([])
-            plt.title(f"Expenditures Over Time, {self.line_month_entry.get()}")
-            plt.subplots_adjust(bottom=0.19)
-            plt.show()
-
-
-# checks if the user is successfully logged in before proceeding to main screen
-if startup_screen.check_login:
-    app = Main()
-    app.mainloop()
+            chart = self._chart_window("line", "Expenditures Over Time", figsize=(6, 5))
+            axes = chart.axes
+
+            # first use: create the line and the features that stay the same between updates
+            if not chart.artists:
+                from matplotlib.dates import AutoDateLocator, ConciseDateFormatter, num2date
+
+                chart.artists["line"], = axes.plot([], [], color=DARK_PINK)
+
+                # show x and y coords live
+                axes.format_coord = lambda x, y: "Date: {}, Expense ($): {:.0f}".format(
+                    num2date(x).strftime('%Y-%m-%d'), y)
+
+                axes.set_ylabel("Amount Spent ($)", color='black')
+                axes.set_xlabel("Time", color='black')
+                # dates along the x axis, hide the y axis ticks
+                locator = AutoDateLocator(maxticks=6)
+                axes.xaxis.set_major_locator(locator)
+                axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+                axes.tick_params(axis='x', labelsize='small', labelcolor='black')
+                axes.yaxis.set_ticks([])
+                chart.figure.subplots_adjust(bottom=0.19)
+
+            chart.artists["line"].set_data(edges, cumulative)
+            axes.set_title(f"Expenditures Over Time, {title}")
+            chart.rescale()
+            chart.show()
+
+    # the reusable window for a chart kind, created the first time it is needed
+    def _chart_window(self, kind, title, figsize):
+        if kind not in self._charts:
+            self._charts[kind] = ChartWindow(self, title, figsize)
+        return self._charts[kind]
+
+
+if __name__ == "__main__":
+    startup.mark("imports")
+    startup_screen = run_login(on_ready=partial(startup.mark, "login screen"))
+    startup.skip()
+
+    # checks if the user is successfully logged in before proceeding to main screen
+    if startup_screen.check_login:
+        app = Main(startup_screen)
+        startup.mark("dashboard built")
+
+        # the dashboard is interactive once Tk has drawn it and is waiting for events
+        def dashboard_ready():
+            startup.mark("dashboard shown")
+            startup.print()
+        app.after_idle(dashboard_ready)
+        app.mainloop()
@@ -0,0 +1,95 @@
+import argparse
+
+import credentials
+from backend import *
+from exporter import export_expenses
+from snapshot import write_snapshot
+
+
+def verify_totals(args):
+    drift = verify_monthly_totals()
+    for user, year_month, category, stored, expected in drift:
+        print(f"{user} {year_month} {category}: stored {stored}, expected {expected}")
+    print(f"{len(drift)} drifted row(s) in monthly_totals")
+    return 1 if drift else 0
+
+
+def rebuild_totals(args):
+    rebuild_monthly_totals()
+    print("monthly_totals rebuilt")
+    return 0
+
+
+def export(args):
+    count = export_expenses(args.user, args.file, args.start, args.end, args.category, compress=args.gzip or None,
+                            progress=lambda rows: print(f"\r{rows:,} rows", end="", flush=True))
+    print(f"\rexported {count:,} rows to {args.file}")
+    return 0
+
+
+def snapshot(args):
+    count, size = write_snapshot(args.user, args.file, args.start, args.end)
+    print(f"wrote {count:,} rows ({size:,} bytes) to {args.file}")
+    return 0
+
+
+def move_users(args):
+    if not SHARDING:
+        print("sharding is off: set EXPENSE_SHARDING (and EXPENSE_SHARD_DIR) to the settings the app will use")
+        return 1
+    moved = move_to_shards(progress=lambda done, total: print(f"\r{done:,}/{total:,} users", end="", flush=True))
+    print(f"\rmoved {moved:,} user(s) from {EXPENSE_DB} into their shards in {SHARD_DIR}")
+    # check that everything is in place for the app
+    prepare_databases()
+    return 0
+
+
+def calibrate_hashing(args):
+    scheme = credentials.calibrate(args.target_ms / 1000, args.algorithm)
+    print(f"{scheme} takes at least {args.target_ms}ms per password on this machine")
+    print(f"to use it, set EXPENSE_PASSWORD_HASH={scheme} (passwords are rehashed as users log in)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expense Tracker database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("verify-totals", help="compare monthly_totals with the expenses table").set_defaults(
+        func=verify_totals)
+    commands.add_parser("rebuild-totals", help="recompute monthly_totals from the expenses table").set_defaults(
+        func=rebuild_totals)
+
+    export_parser = commands.add_parser("export", help="stream a user's expenses to a .csv/.tsv(.gz) file")
+    export_parser.add_argument("user")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--start", help="first date to include (YYYY-MM-DD)")
+    export_parser.add_argument("--end", help="first date to leave out (YYYY-MM-DD)")
+    export_parser.add_argument("--category")
+    export_parser.add_argument("--gzip", action="store_true", help="compress the output")
+    export_parser.set_defaults(func=export)
+
+    snapshot_parser = commands.add_parser("snapshot", help="write a user's expenses to a columnar .exsnap file")
+    snapshot_parser.add_argument("user")
+    snapshot_parser.add_argument("file")
+    snapshot_parser.add_argument("--start", help="first date to include (YYYY-MM-DD)")
+    snapshot_parser.add_argument("--end", help="first date to leave out (YYYY-MM-DD)")
+    snapshot_parser.set_defaults(func=snapshot)
+
+    commands.add_parser("move-to-shards", help="move data stored before sharding was switched on into the shards"
+                        ).set_defaults(func=move_users)
+
+    calibrate_parser = commands.add_parser("calibrate-hashing",
+                                           help="find password hashing parameters for a target login time")
+    calibrate_parser.add_argument("--target-ms", type=float, default=100, help="time to spend hashing a password")
+    calibrate_parser.add_argument("--algorithm", choices=sorted(credentials.ALGORITHMS))
+    calibrate_parser.set_defaults(func=calibrate_hashing)
+
+    args = parser.parse_args()
+    # the other commands refuse to start until the data has been moved
+    if args.func is not move_users:
+        prepare_databases()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
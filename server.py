@@ -0,0 +1,398 @@
+import argparse
+import base64
+import binascii
+import json
+import re
+import sqlite3
+import traceback
+import types
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from backend import *
+
+
+# Local HTTP/JSON API over the backend, for scripts and batch jobs.
+#
+#   python server.py --port 8765
+#   curl -u alice:secret localhost:8765/expenses?start=2024-01-01
+#
+# Requests are authenticated with HTTP basic auth against the login database (POST /users registers a new
+# user) and only ever see the authenticated user's data. Connections are handled by a fixed pool of threads,
+# and each thread keeps its SQLite connections between requests. Expense lists are streamed as they are
+# read, so exporting everything doesn't build the whole response in memory; POST /batch runs several
+# requests in one transaction.
+#
+# Amounts are sent as dollars ("amount": 12.5 or "12.50") and returned as integer cents ("amount_cents"),
+# dates are "YYYY-MM-DD".
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 16
+
+# a kept-alive connection that sends nothing for this long is closed, freeing its worker (seconds)
+IDLE_TIMEOUT = 30
+
+# largest request body accepted (bytes)
+MAX_BODY = 16 * 1024 * 1024
+
+# largest ?limit= of an expense page
+MAX_PAGE_SIZE = 1000
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# --------------------------------------------------- rows as JSON
+
+def expense_json(row):
+    return {"id": row[5], "name": row[1], "amount_cents": row[2], "category": row[3], "date": format_day(row[4])}
+
+
+def budget_json(row):
+    return {"id": row[3], "category": row[1], "amount_cents": row[2]}
+
+
+def _field(body, name):
+    try:
+        return body[name]
+    except (KeyError, TypeError):
+        raise APIError(400, f"missing field: {name}") from None
+
+
+# [start, end) of a request: ?month=March&year=2024 (or month=All Time), or ?start=...&end=... dates
+def _period(query):
+    if "month" in query:
+        return period_bounds(query["month"], _field(query, "year"))
+    return to_day(_field(query, "start")), to_day(_field(query, "end"))
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- handlers
+# each takes (user, path parameters, query parameters, body) and returns what to send back as JSON
+# (a generator of row lists is streamed)
+
+def register(user, params, query, body):
+    username, password = _field(body, "username"), _field(body, "password")
+    # the same rules as the sign up screen: neither may be blank, surrounding spaces are dropped
+    if not isinstance(username, str) or not username.strip():
+        raise APIError(400, "username must be a non-empty string")
+    if not isinstance(password, str) or not password.strip():
+        raise APIError(400, "password must be a non-empty string")
+    username = username.strip()
+    # new users start with the default categories, as in the app
+    if not register_user(username, password.strip()):
+        raise APIError(409, "username already exists")
+    return {"username": username}
+
+
+def list_categories(user, params, query, body):
+    return query_categories(user)
+
+
+def add_category(user, params, query, body):
+    insert_category(user, _field(body, "category"))
+    return {"category": body["category"]}
+
+
+def remove_category(user, params, query, body):
+    delete_category(user, params[0])
+    return {"category": params[0]}
+
+
+# all (or some: ?start=&end=&category=) of the user's expenses, streamed in ?sort= order
+def list_expenses(user, params, query, body):
+    for rows in stream_expenses(user, query.get("start"), query.get("end"), query.get("category"),
+                                query.get("sort", "date-added")):
+        yield [expense_json(row) for row in rows]
+
+
+# one page in ?sort= / ?direction= order; pass "next" back as ?after= for the following page
+def expense_page(user, params, query, body):
+    sort_method = query.get("sort", "date-added")
+    after = tuple(json.loads(query["after"])) if "after" in query else None
+    # a key from another sort order would bind the wrong number of parameters
+    if after is not None and len(after) != len(PAGE_ORDER.get(sort_method, ())):
+        raise APIError(400, f"after is not a next key of sort {sort_method!r}")
+    limit = int(query.get("limit", PAGE_SIZE))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise APIError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    rows = fetch_expense_page(user, sort_method, after, limit, query.get("direction", "asc"))
+    return {"rows": [expense_json(row) for row in rows],
+            "next": page_key(sort_method, rows[-1]) if rows else None}
+
+
+def expenses_for_month(user, params, query, body):
+    return [expense_json(row) for row in fetch_expenses_from(user, _field(query, "month"), _field(query, "year"))]
+
+
+def add_expense(user, params, query, body):
+    return {"id": insert_expense(user, _field(body, "name"), _field(body, "amount"), _field(body, "category"),
+                                 _field(body, "date"))}
+
+
+def edit_expense(user, params, query, body):
+    if not update_expense(user, _field(body, "name"), _field(body, "amount"), _field(body, "category"),
+                          _field(body, "date"), int(params[0])):
+        raise APIError(404, f"no expense {params[0]}")
+    return {"id": int(params[0])}
+
+
+def remove_expense(user, params, query, body):
+    if not delete_expense(user, int(params[0])):
+        raise APIError(404, f"no expense {params[0]}")
+    return {"id": int(params[0])}
+
+
+def list_budgets(user, params, query, body):
+    return [budget_json(row) for row in query_budgets(user)]
+
+
+def add_budget(user, params, query, body):
+    return {"id": insert_budget(user, _field(body, "category"), _field(body, "amount"))}
+
+
+def edit_budget(user, params, query, body):
+    if not update_budget(user, _field(body, "category"), _field(body, "amount"), int(params[0])):
+        raise APIError(404, f"no budget {params[0]}")
+    return {"id": int(params[0])}
+
+
+def remove_budget(user, params, query, body):
+    if not delete_budget(user, int(params[0])):
+        raise APIError(404, f"no budget {params[0]}")
+    return {"id": int(params[0])}
+
+
+def category_totals_json(user, params, query, body):
+    return [{"category": category, "total_cents": total}
+            for category, total in chart_series(user, *_period(query), "pie")]
+
+
+def budget_totals_json(user, params, query, body):
+    return [{"category": category, "budget_cents": budget, "spent_cents": spent}
+            for category, budget, spent in chart_series(user, *_period(query), "bar")]
+
+
+def daily_totals_json(user, params, query, body):
+    return [{"date": format_day(day), "total_cents": total}
+            for day, total in chart_series(user, *_period(query), "line")]
+
+
+# {"requests": [{"method": ..., "path": ..., "body": ...}, ...]} run in order in one transaction: all of them
+# take effect or none do; returns {"responses": [...]} in the same order
+def batch(user, params, query, body):
+    requests = _field(body, "requests")
+    responses = []
+    with transaction(shard_for(user)):
+        for index, request in enumerate(requests):
+            method, path = _field(request, "method").upper(), _field(request, "path")
+            handler, params, query, needs_login = route(method, path)
+            if handler is batch or not needs_login:
+                raise APIError(400, f"request {index}: {method} {urlsplit(path).path} can't be batched")
+            result = handler(user, params, query, request.get("body"))
+            if isinstance(result, types.GeneratorType):
+                raise APIError(400, f"request {index}: streamed lists can't be batched, use /expenses/page")
+            responses.append(result)
+    return {"responses": responses}
+
+
+# (method, path pattern, handler, needs login)
+ROUTES = [
+    ("POST", r"/users", register, False),
+    ("GET", r"/categories", list_categories, True),
+    ("POST", r"/categories", add_category, True),
+    ("DELETE", r"/categories/([^/]+)", remove_category, True),
+    ("GET", r"/expenses", list_expenses, True),
+    ("GET", r"/expenses/page", expense_page, True),
+    ("GET", r"/expenses/month", expenses_for_month, True),
+    ("POST", r"/expenses", add_expense, True),
+    ("PUT", r"/expenses/(\d+)", edit_expense, True),
+    ("DELETE", r"/expenses/(\d+)", remove_expense, True),
+    ("GET", r"/budgets", list_budgets, True),
+    ("POST", r"/budgets", add_budget, True),
+    ("PUT", r"/budgets/(\d+)", edit_budget, True),
+    ("DELETE", r"/budgets/(\d+)", remove_budget, True),
+    ("GET", r"/totals/categories", category_totals_json, True),
+    ("GET", r"/totals/budgets", budget_totals_json, True),
+    ("GET", r"/totals/daily", daily_totals_json, True),
+    ("POST", r"/batch", batch, True),
+]
+
+_ROUTES = [(method, re.compile(pattern), handler, needs_login) for method, pattern, handler, needs_login in ROUTES]
+
+
+# the handler for a request: (handler, path parameters, query parameters, needs login)
+def route(method, target):
+    url = urlsplit(target)
+    allowed = False
+    for route_method, pattern, handler, needs_login in _ROUTES:
+        match = pattern.fullmatch(url.path)
+        if match is None:
+            continue
+        if route_method == method:
+            return handler, [unquote(param) for param in match.groups()], dict(parse_qsl(url.query)), needs_login
+        allowed = True
+    if allowed:
+        raise APIError(405, f"{method} not allowed on {url.path}")
+    raise APIError(404, f"no such resource: {url.path}")
+
+# ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------- HTTP
+
+class APIHandler(BaseHTTPRequestHandler):
+    # keep connections open between requests
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT
+    # headers and body are written separately; don't let the body wait for the client's ACK of the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _dispatch(self, method):
+        try:
+            # always read the body, so the next request on the connection starts in the right place
+            body = self._read_body()
+            handler, params, query, needs_login = route(method, self.path)
+            user = self._authenticate() if needs_login else None
+            result = handler(user, params, query, body)
+            if isinstance(result, types.GeneratorType):
+                self._send_stream(result)
+            else:
+                self._send_json(200, result)
+        except APIError as error:
+            self._send_json(error.status, {"error": str(error)})
+        except (ValueError, KeyError, TypeError) as error:
+            self._send_json(400, {"error": f"bad request: {error}"})
+        except sqlite3.OperationalError as error:
+            # e.g. the database stayed locked past the retries
+            self._send_json(503, {"error": str(error)})
+        except Exception:
+            traceback.print_exc()
+            self._send_json(500, {"error": "internal error"})
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            self.close_connection = True
+            raise APIError(413, "request body too large")
+        if length == 0:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    # the user named by the basic auth header, if the password is right (repeat logins are cached)
+    def _authenticate(self):
+        scheme, _, credentials = (self.headers.get("Authorization") or "").partition(" ")
+        try:
+            username, _, password = base64.b64decode(credentials, validate=True).decode().partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            username = password = None
+        if scheme.lower() != "basic" or not username or not verify_user(username, password):
+            raise APIError(401, "login required")
+        return username
+
+    def _send_json(self, status, value):
+        data = json.dumps(value, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 401:
+            self.send_header("WWW-Authenticate", 'Basic realm="expense-tracker"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    # send a JSON array chunk by chunk as the rows are read
+    def _send_stream(self, chunks):
+        # read the first chunk before answering, so a bad request still gets an error status
+        first = next(chunks, [])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            separator = b"["
+            for rows in _chain(first, chunks):
+                if rows:
+                    self._write_chunk(separator + b",".join(json.dumps(row, separators=(",", ":")).encode()
+                                                            for row in rows))
+                    separator = b","
+            self._write_chunk(b"[]" if separator == b"[" else b"]")
+            self.wfile.write(b"0\r\n\r\n")
+        except Exception:
+            # the status has been sent already; cutting the response short tells the client it failed
+            self.close_connection = True
+            raise
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+class APIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers=WORKERS, verbose=False):
+        super().__init__(address, APIHandler)
+        self.verbose = verbose
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="expense-api")
+
+    # handle each connection on a pool thread rather than a new thread, so the threads (and the database
+    # connections they keep) are reused
+    def process_request(self, request, client_address):
+        self._executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# ----------------------------------------------------------------------------------------------
+
+
+def serve(host=HOST, port=PORT, workers=WORKERS, verbose=False):
+    prepare_databases()
+    with APIServer((host, port), workers, verbose) as server:
+        print(f"serving on http://{server.server_address[0]}:{server.server_address[1]}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON API for Expense Tracker")
+    parser.add_argument("--host", default=HOST, help="address to listen on (default: this machine only)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="connections handled at once")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.verbose)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,155 @@
+import json
+import struct
+import sys
+import zlib
+from array import array
+from datetime import date
+
+from backend import from_day, stream_expenses, to_day
+
+
+# Columnar snapshot of a user's expense history.
+#
+# Layout: MAGIC, then one row group per month holding each column as a separately compressed
+# chunk, then a JSON footer (schema, category dictionary, and the offset/length of every chunk),
+# then the footer length and MAGIC again. Readers seek straight to the chunks of the columns they
+# need, so e.g. summing amount_cents per category never touches the name column.
+
+MAGIC = b"EXSNAP2\0"
+
+# column name -> array typecode (strings are stored as offsets + utf-8 data, categories as dictionary codes)
+SCHEMA = {
+    "id": "q",            # int64
+    "day": "i",           # int32 days since 1970-01-01
+    "amount_cents": "q",  # int64
+    "category": "I",      # uint32 index into the category dictionary
+    "name": "str",        # utf-8
+}
+
+
+# arrays are stored little-endian whatever machine wrote them
+def _to_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _encode_column(typecode, values):
+    if typecode == "str":
+        encoded = [value.encode() for value in values]
+        offsets = array("I", [0])
+        for item in encoded:
+            offsets.append(offsets[-1] + len(item))
+        data = struct.pack("<I", len(offsets)) + _to_bytes(offsets) + b"".join(encoded)
+    else:
+        data = _to_bytes(array(typecode, values))
+    return zlib.compress(data, 6)
+
+
+def _decode_column(typecode, data):
+    data = zlib.decompress(data)
+    if typecode == "str":
+        count = struct.unpack_from("<I", data)[0]
+        start = 4 + count * array("I").itemsize
+        offsets = _from_bytes("I", data[4:start])
+        return [data[start + offsets[i]:start + offsets[i + 1]].decode() for i in range(count - 1)]
+    return _from_bytes(typecode, data)
+
+
+# write a user's expenses (optionally only dates in [start, end)) to a snapshot file,
+# returns (rows written, file size in bytes)
+def write_snapshot(user, path, start=None, end=None, progress=None):
+    categories = {}
+    row_groups = []
+    count = 0
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+
+        def flush(month, columns):
+            chunks = {}
+            for column, values in columns.items():
+                data = _encode_column(SCHEMA[column], values)
+                chunks[column] = [file.tell(), len(data)]
+                file.write(data)
+            row_groups.append({"month": month, "rows": len(columns["id"]), "columns": chunks})
+
+        month, month_end, columns = None, None, None
+        # rows come sorted by date, so each month's rows arrive together
+        for rows in stream_expenses(user, start, end, sort_method="date"):
+            for row in rows:
+                if month_end is None or row[4] >= month_end:
+                    if columns is not None:
+                        flush(month, columns)
+                    first = from_day(row[4]).replace(day=1)
+                    month = first.isoformat()[:7]
+                    month_end = to_day(date(first.year + first.month // 12, first.month % 12 + 1, 1))
+                    columns = {column: [] for column in SCHEMA}
+                columns["id"].append(row[5])
+                columns["day"].append(row[4])
+                columns["amount_cents"].append(row[2])
+                columns["category"].append(categories.setdefault(row[3], len(categories)))
+                columns["name"].append(row[1])
+            count += len(rows)
+            if progress is not None:
+                progress(count)
+        if columns is not None:
+            flush(month, columns)
+
+        footer = json.dumps({"user": user, "rows": count, "schema": SCHEMA,
+                             "categories": list(categories), "row_groups": row_groups}).encode()
+        file.write(footer)
+        file.write(struct.pack("<Q", len(footer)))
+        file.write(MAGIC)
+        size = file.tell()
+
+    return count, size
+
+
+# read the footer (metadata) of a snapshot file
+def read_metadata(path):
+    with open(path, "rb") as file:
+        return _read_footer(file)
+
+
+def _read_footer(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not an expense snapshot file")
+    file.seek(-(8 + len(MAGIC)), 2)
+    footer_length = struct.unpack("<Q", file.read(8))[0]
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Snapshot file is incomplete")
+    file.seek(-(8 + len(MAGIC) + footer_length), 2)
+    return json.loads(file.read(footer_length))
+
+
+# read some (default: all) columns of a snapshot, optionally only for some months ("YYYY-MM"),
+# returns {column: values}; categories come back decoded, days as day numbers since 1970-01-01
+def read_snapshot(path, columns=None, months=None):
+    with open(path, "rb") as file:
+        metadata = _read_footer(file)
+        schema = metadata["schema"]
+        columns = list(columns or schema)
+        result = {column: [] for column in columns}
+
+        for group in metadata["row_groups"]:
+            if months is not None and group["month"] not in months:
+                continue
+            for column in columns:
+                offset, length = group["columns"][column]
+                file.seek(offset)
+                result[column].extend(_decode_column(schema[column], file.read(length)))
+
+    if "category" in result:
+        dictionary = metadata["categories"]
+        result["category"] = [dictionary[code] for code in result["category"]]
+    return result
@@ -0,0 +1,170 @@
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from backend import *
+from benchmark import percentile
+
+
+# Concurrent write stress test: several processes insert, update and delete expenses in the same databases
+# (as several app instances would) for a while, then the results are checked for lost updates.
+#
+#   python stress.py --writers 8 --seconds 10
+#   python stress.py --writers 8 --own-users --sharding user
+#
+# Every writer also increments a shared counter (a budget row) with a read-modify-write transaction, so a
+# write that overwrote another's shows up as a missing increment. The run fails if any writer's expenses,
+# the counter or the monthly_totals rollup don't match what the writers report they committed.
+
+WRITERS = 4
+SECONDS = 5.0
+USER = "stress"
+COUNTER = "Counter"
+
+# writers start together this long after being launched (process startup isn't timed)
+START_DELAY = 2.0
+
+
+def writer_user(index, own_users):
+    return f"{USER}{index:03d}" if own_users else USER
+
+
+# the counter budget's id for a user
+def counter_id(user):
+    return get_connection(shard_for(user)).execute("SELECT id FROM budgets WHERE user=? AND category=?",
+                                                   (user, COUNTER)).fetchone()[0]
+
+
+def prepare(writers, own_users):
+    prepare_databases()
+    for user in sorted({writer_user(index, own_users) for index in range(writers)}):
+        insert_budget(user, COUNTER, 0)
+
+
+# one writer process: cycles through insert / update / delete / increment until the time is up, and
+# reports what it committed
+def write(index, expense_db, user_db, sharding, shard_dir, own_users, start_at, seconds):
+    use_databases(expense_db, user_db, sharding=sharding, shard_dir=shard_dir)
+    user = writer_user(index, own_users)
+    name = f"writer{index:03d}"
+    counter = counter_id(user)
+    day = to_day("2024-06-15")
+
+    # id -> cents of this writer's expenses that should still exist
+    expenses = {}
+    increments = 0
+    writes = 0
+    failed = 0
+    latencies = []
+
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.perf_counter() + seconds
+    step = 0
+    while time.perf_counter() < deadline:
+        step += 1
+        started = time.perf_counter()
+        try:
+            if step % 5 == 0 and expenses:
+                oid = next(iter(expenses))
+                delete_expense(user, oid)
+                del expenses[oid]
+            elif step % 4 == 0 and expenses:
+                oid = next(reversed(expenses))
+                update_expense(user, name, 2, "Home", day, oid)
+                expenses[oid] = 200
+            elif step % 3 == 0:
+                with transaction(shard_for(user)) as conn:
+                    cents = conn.execute("SELECT amount_cents FROM budgets WHERE id=?", (counter,)).fetchone()[0]
+                    update_budget(user, COUNTER, from_cents(cents + 1), counter)
+                increments += 1
+            else:
+                expenses[insert_expense(user, name, 1, "Home", day)] = 100
+        except sqlite3.OperationalError:
+            # gave up waiting for the lock; the transaction was never started, so nothing to undo
+            failed += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        writes += 1
+
+    return {"user": user, "name": name, "count": len(expenses), "cents": sum(expenses.values()),
+            "increments": increments, "writes": writes, "failed": failed, "latencies": latencies,
+            "stats": write_stats()}
+
+
+# compare what the writers committed with what is in the databases, returns a list of problems
+def check(results):
+    problems = []
+    for result in results:
+        count, cents = get_connection(shard_for(result["user"])).execute(
+            "SELECT COUNT(*), COALESCE(SUM(amount_cents), 0) FROM expenses WHERE user=? AND name=?",
+            (result["user"], result["name"])).fetchone()
+        if (count, cents) != (result["count"], result["cents"]):
+            problems.append(f"{result['name']}: {count} expenses / {cents} cents stored, "
+                            f"{result['count']} / {result['cents']} committed")
+
+    for user in sorted({result["user"] for result in results}):
+        stored = get_connection(shard_for(user)).execute("SELECT amount_cents FROM budgets WHERE id=?",
+                                                         (counter_id(user),)).fetchone()[0]
+        expected = sum(result["increments"] for result in results if result["user"] == user)
+        if stored != expected:
+            problems.append(f"{user}: counter is {stored}, {expected} increments committed ({expected - stored} lost)")
+
+    drift = verify_monthly_totals()
+    if drift:
+        problems.append(f"{len(drift)} drifted row(s) in monthly_totals")
+    return problems
+
+
+def run(writers=WRITERS, seconds=SECONDS, sharding="", own_users=False, directory=None, progress=print):
+    with tempfile.TemporaryDirectory(prefix="expense-stress-") as scratch:
+        directory = directory or scratch
+        expense_db = os.path.join(directory, "expenses.db")
+        user_db = os.path.join(directory, "login_info.db")
+        shard_dir = os.path.join(directory, "shards")
+        use_databases(expense_db, user_db, sharding=sharding, shard_dir=shard_dir)
+        prepare(writers, own_users)
+        # the writers open their own connections
+        close_connections()
+
+        start_at = time.time() + START_DELAY
+        # spawn rather than fork, so no connection is inherited from this process
+        with multiprocessing.get_context("spawn").Pool(writers) as pool:
+            results = pool.starmap(write, [(index, expense_db, user_db, sharding, shard_dir, own_users, start_at,
+                                            seconds) for index in range(writers)])
+
+        writes = sum(result["writes"] for result in results)
+        latencies = [latency for result in results for latency in result["latencies"]]
+        totals = {key: sum(result["stats"][key] for result in results) for key in ("retries", "lock_wait")}
+        failed = sum(result["failed"] for result in results)
+        progress(f"{writers} writers, {seconds:g}s, sharding {sharding or 'off'}, "
+                 f"{'own users' if own_users else 'one shared user'}")
+        progress(f"  {writes:,} writes, {writes / seconds:,.1f} writes/s, "
+                 f"p50 {percentile(latencies, 0.50) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+        progress(f"  {totals['retries']:,} retries, {failed:,} writes failed, "
+                 f"{totals['lock_wait']:.2f}s waiting for the write lock")
+
+        problems = check(results)
+        for problem in problems:
+            progress(f"  LOST UPDATE: {problem}")
+        if not problems:
+            progress("  no lost updates")
+        close_connections()
+        return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress Expense Tracker with concurrent writer processes")
+    parser.add_argument("--writers", type=int, default=WRITERS, help="number of writer processes")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="how long the writers run")
+    parser.add_argument("--sharding", default="", help="'user' or a number of files (default: one database file)")
+    parser.add_argument("--own-users", action="store_true", help="each writer writes as its own user")
+    parser.add_argument("--directory", help="keep the databases in this directory (default: a temporary one)")
+    args = parser.parse_args()
+    return 1 if run(args.writers, args.seconds, args.sharding, args.own_users, args.directory) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+# how often (in ms) the Tk event loop picks up finished tasks
+POLL_INTERVAL = 20
+
+
+# runs backend work on a thread pool and hands the results back to the Tk main thread
+class TaskRunner:
+    def __init__(self, widget, workers=2):
+        self._widget = widget
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="expense-tracker")
+        # finished futures waiting to be handled on the main thread
+        self._finished = queue.SimpleQueue()
+        # calls posted from worker threads (e.g. progress updates)
+        self._posted = queue.SimpleQueue()
+        # key -> (token, future) of the newest task submitted under that key
+        self._latest = {}
+        self._poll_id = self._widget.after(POLL_INTERVAL, self._poll)
+
+    # run func(*args) on a worker; a newer task with the same key replaces this one, so its callbacks never run
+    def submit(self, key, func, *args, on_done=None, on_error=None):
+        self.cancel(key)
+        token = object()
+        future = self._executor.submit(func, *args)
+        self._latest[key] = (token, future)
+        # callbacks are queued here (worker thread) and run by _poll (main thread)
+        future.add_done_callback(lambda f: self._finished.put((key, token, f, on_done, on_error)))
+        return future
+
+    # drop a task: it is cancelled if it hasn't started, otherwise its result is ignored
+    def cancel(self, key):
+        latest = self._latest.pop(key, None)
+        if latest is not None:
+            latest[1].cancel()
+
+    def is_running(self, key):
+        return key in self._latest
+
+    # safe to call from any thread: run func(*args) on the main thread
+    def post(self, func, *args):
+        self._posted.put((func, args))
+
+    def _poll(self):
+        while True:
+            try:
+                func, args = self._posted.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception:
+                self._widget.report_callback_exception(*sys.exc_info())
+
+        while True:
+            try:
+                key, token, future, on_done, on_error = self._finished.get_nowait()
+            except queue.Empty:
+                break
+
+            # skip tasks that were cancelled or replaced by a newer one
+            latest = self._latest.get(key)
+            if latest is None or latest[0] is not token or future.cancelled():
+                continue
+            del self._latest[key]
+
+            error = future.exception()
+            try:
+                if error is None:
+                    if on_done is not None:
+                        on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    self._widget.report_callback_exception(type(error), error, error.__traceback__)
+            except Exception:
+                self._widget.report_callback_exception(*sys.exc_info())
+
+        self._poll_id = self._widget.after(POLL_INTERVAL, self._poll)
+
+    # stop polling and abandon queued work (call when the window closes)
+    def shutdown(self):
+        self._widget.after_cancel(self._poll_id)
+        self._latest.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
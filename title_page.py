@@ -52,10 +52,7 @@ class RegisterScreen(Tk):
 
         self.resizable(width=False, height=False)
 
-        connect_user()
-        connect_categories()
-        connect_expense()
-        connect_budget()
+        prepare_databases()
 
         # startup screen widgets
         Label(self, text="Expense Tracker", font=self.TITLE_FONT).place(relx=0.5, rely=0.35, anchor=CENTER)
@@ -138,57 +135,47 @@ class RegisterScreen(Tk):
 
     # Implementing event on register button
     def register_user(self):
-        # query user info from database
+        # error check for empty entries
+        if len(self.get_username()) == 0 or len(self.get_password()) == 0:
+            self.username_entry.delete(0, END)  # clears username input box
+            self.password_entry.delete(0, END)  # clears password input box
+            messagebox.showerror("Oops!", "Please fill in both entries")
+            return
+
+        # Insert user info into database (fails for already-existing usernames)
         connect_user()
-        self._user_info_records = query_user()
-
-        for record in self._user_info_records:
-            # error check for already-existing usernames
-            if record[0] == self.get_username():
-                self.username_entry.delete(0, END)  # clears username input box
-                self.password_entry.delete(0, END)  # clears password input box
-                messagebox.showerror("Oops!", "Username already exists")
-                break
-
-            # error check for empty entries
-            elif len(self.get_username()) == 0 or len(self.get_password()) == 0:
-                self.username_entry.delete(0, END)  # clears username input box
-                self.password_entry.delete(0, END)  # clears password input box
-                messagebox.showerror("Oops!", "Please fill in both entries")
-                break
-        else:
-            # Insert user info into database
-            insert_user(self.get_username(), self.get_password())
+        if not create_user(self.get_username(), self.get_password()):
+            self.username_entry.delete(0, END)  # clears username input box
+            self.password_entry.delete(0, END)  # clears password input box
+            messagebox.showerror("Oops!", "Username already exists")
+            return
 
-            # pop up indicating success
-            messagebox.showinfo("Success", "Registration Success")
+        # pop up indicating success
+        messagebox.showinfo("Success", "Registration Success")
 
-            # close main window
-            self.signup_screen.destroy()
+        # close main window
+        self.signup_screen.destroy()
 
     # Implementing event on login button
     def login_verify(self):
 
-        # query user info from database
-        self._user_info_records = query_user()
+        # check the password against the one stored for the user
+        verified = verify_user(self.login_username.get(), self.login_password.get())
 
-        for record in self._user_info_records:
-            if record[0] == self.login_username.get():
-                if record[1] == self.login_password.get():
-                    self.login_success()
-                else:
-                    self.password_not_recognised()
-                break
-        else:
+        if verified is None:
             self.user_not_found()
+        elif verified:
+            self.login_success()
+        else:
+            self.password_not_recognised()
 
     # Designing popup for login success
     def login_success(self):
         messagebox.showinfo("Success", "Login Success")
         self.login_screen.destroy()
-        self.win_x_coord = startup_screen.winfo_rootx()
-        self.win_y_coord = startup_screen.winfo_rooty()
-        startup_screen.destroy()
+        self.win_x_coord = self.winfo_rootx()
+        self.win_y_coord = self.winfo_rooty()
+        self.destroy()
         self.confirm_login(login=True)
 
     # Designing popup for login invalid password
@@ -209,5 +196,15 @@ class RegisterScreen(Tk):
         self.check_login = login
 
 
-startup_screen = RegisterScreen()
-startup_screen.mainloop()
+# show the login screen until the user logs in or closes it, returns the screen
+# (check_login says whether the login succeeded); on_ready is called once the screen is up
+def run_login(on_ready=None):
+    screen = RegisterScreen()
+    if on_ready is not None:
+        screen.after_idle(on_ready)
+    screen.mainloop()
+    return screen
+
+
+if __name__ == "__main__":
+    run_login()